@@ -32,9 +32,15 @@ bl_info = {
 
 import bpy
 from bpy.props import PointerProperty, BoolProperty, StringProperty
+from bpy.props import IntProperty
 from bpy.types import PropertyGroup, UIList, Panel, Operator
 
 from . import cm_prefs
+from . import cm_profiler
+from . import cm_keyframes
+from . import cm_playback
+from . import cm_nla
+from . import cm_brainCodegen
 from . icon_load import register_icons, unregister_icons, cicon
 from . import addon_updater_ops
 from . cm_graphics import cm_nodeHUD
@@ -192,6 +198,50 @@ customSyncMode = 'NONE' # This saves the sync_mode value
 customOutline = True # This saves the outline value
 customRLines = True # This saves the relationship lines value
 
+
+def newSimulation(scene, clear=True):
+    """Replace the current simulation with a new one containing all the
+    agents in the scene"""
+    global sim
+    if "sim" in globals():
+        sim.stopFrameHandler()
+        del sim
+    sim = Simulation()
+    sim.setupActions()
+
+    for group in scene.cm_groups:
+        sim.createAgents(group, clear)
+
+    return sim
+
+
+def reportOptimised(operator, sim):
+    """Tell the user what was folded and removed from each brain (see
+    BrainProgram.optimise)"""
+    for program in sim.compbrains.values():
+        if program.folded or program.removed:
+            operator.report({'INFO'}, program.report())
+
+
+def prepareInterface():
+    """Turn off the interface options that slow down simulating. They are
+    put back by SCENE_OT_cm_stop"""
+    global customSyncMode
+    global customOutline
+    global customRLines
+
+    customSyncMode = bpy.context.scene.sync_mode
+    bpy.context.scene.sync_mode = 'NONE'
+
+    if bpy.context.screen is not None:
+        for area in bpy.context.screen.areas:
+            if area.type == 'VIEW_3D':
+                customOutline = area.spaces[0].show_outline_selected
+                customRLines = area.spaces[0].show_relationship_lines
+                area.spaces[0].show_outline_selected = False
+                area.spaces[0].show_relationship_lines = False
+
+
 class SCENE_OT_cm_start(Operator):
     """Start the CrowdMaster agent simulation."""
     bl_idname = "scene.cm_start"
@@ -199,25 +249,13 @@ class SCENE_OT_cm_start(Operator):
 
     def execute(self, context):
         scene = context.scene
-        global customSyncMode
-        global customOutline
-        global customRLines
 
         preferences = context.user_preferences.addons[__package__].preferences
         if (bpy.data.is_dirty) and (preferences.ask_to_save):
             self.report({'ERROR'}, "You must save your file first!")
             return {'CANCELLED'}
 
-        customSyncMode = bpy.context.scene.sync_mode
-        bpy.context.scene.sync_mode = 'NONE'
-
-        if bpy.context.screen is not None:
-            for area in bpy.context.screen.areas:
-                if area.type == 'VIEW_3D':
-                    customOutline = area.spaces[0].show_outline_selected
-                    customRLines = area.spaces[0].show_relationship_lines
-                    area.spaces[0].show_outline_selected = False
-                    area.spaces[0].show_relationship_lines = False
+        prepareInterface()
 
         if preferences.show_node_hud:
             newhudText = "Simulation Running!"
@@ -226,18 +264,53 @@ class SCENE_OT_cm_start(Operator):
 
         scene.frame_current = scene.frame_start
 
-        global sim
-        if "sim" in globals():
-            sim.stopFrameHandler()
-            del sim
-        sim = Simulation()
-        sim.setupActions()
+        sim = newSimulation(scene)
+        reportOptimised(self, sim)
+
+        sim.startFrameHandler()
+
+        if preferences.play_animation:
+            bpy.ops.screen.animation_play()
+
+        return {'FINISHED'}
+
+
+class SCENE_OT_cm_resume(Operator):
+    """Continue the CrowdMaster agent simulation from a checkpoint."""
+    bl_idname = "scene.cm_resume"
+    bl_label = "Resume Simulation"
+
+    filepath = StringProperty(subtype='FILE_PATH')
+
+    def invoke(self, context, event):
+        preferences = context.user_preferences.addons[__package__].preferences
+        if not self.filepath:
+            self.filepath = bpy.path.abspath(preferences.checkpoint_path)
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        scene = context.scene
+        preferences = context.user_preferences.addons[__package__].preferences
 
-        for group in scene.cm_groups:
-            sim.createAgents(group)
+        prepareInterface()
 
+        sim = newSimulation(scene, clear=False)
+        reportOptimised(self, sim)
+        try:
+            sim.loadCheckpoint(self.filepath)
+        except (OSError, EOFError, KeyError) as e:
+            self.report({'ERROR'}, "Could not load checkpoint: " + str(e))
+            return {'CANCELLED'}
+
+        scene.frame_set(sim.framelast)
         sim.startFrameHandler()
 
+        if preferences.show_node_hud:
+            newhudText = "Simulation Resumed From Frame {}!".format(sim.framelast)
+            update_hud_text(newhudText)
+            cm_redrawAll()
+
         if preferences.play_animation:
             bpy.ops.screen.animation_play()
 
@@ -261,6 +334,7 @@ class SCENE_OT_cm_stop(Operator):
         global sim
         if "sim" in globals():
             sim.stopFrameHandler()
+        cm_profiler.stop()
 
         bpy.context.scene.sync_mode = customSyncMode
         if bpy.context.screen is not None:
@@ -276,6 +350,51 @@ class SCENE_OT_cm_stop(Operator):
 
         return {'FINISHED'}
 
+class SCENE_OT_cm_batch_simulate(Operator):
+    """Run the CrowdMaster simulation for a range of frames without playing
+    the animation or redrawing the interface"""
+    bl_idname = "scene.cm_batch_simulate"
+    bl_label = "Batch Simulate"
+
+    frameStart = IntProperty(name="Start Frame", default=-1,
+                             description="First frame (-1 for scene start)")
+    frameEnd = IntProperty(name="End Frame", default=-1,
+                           description="Last frame (-1 for scene end)")
+    save = BoolProperty(name="Save When Finished", default=False,
+                        description="Save the .blend file after simulating")
+    reduce = BoolProperty(name="Reduce Keyframes", default=False,
+                          description="Remove the keyframes that aren't needed after simulating")
+
+    def execute(self, context):
+        scene = context.scene
+        preferences = context.user_preferences.addons[__package__].preferences
+
+        frameStart = scene.frame_start if self.frameStart < 0 else self.frameStart
+        frameEnd = scene.frame_end if self.frameEnd < 0 else self.frameEnd
+
+        scene.frame_current = frameStart
+
+        sim = newSimulation(scene)
+        reportOptimised(self, sim)
+        fps = sim.run(frameStart, frameEnd)
+        cm_profiler.stop()
+
+        if self.reduce:
+            bpy.ops.scene.cm_reduce_keyframes()
+
+        if self.save:
+            bpy.ops.wm.save_mainfile()
+
+        message = "Simulated frames {} to {} at {:.2f} frames per second"
+        self.report({'INFO'}, message.format(frameStart, frameEnd, fps))
+
+        if preferences.show_node_hud:
+            newhudText = "Batch Simulation Finished!"
+            update_hud_text(newhudText)
+            cm_redrawAll()
+
+        return {'FINISHED'}
+
 # =============== SIMULATION END ===============#
 
 
@@ -313,6 +432,21 @@ class SCENE_PT_CrowdMaster(Panel):
         else:
             row.operator(SCENE_OT_cm_stop.bl_idname, icon='CANCEL')
 
+        row = layout.row()
+        row.operator(SCENE_OT_cm_batch_simulate.bl_idname, icon='RENDER_ANIMATION')
+        row.operator(SCENE_OT_cm_resume.bl_idname, icon='RECOVER_LAST')
+
+        row = layout.row()
+        row.operator(cm_playback.SCENE_OT_cm_bake_trajectories.bl_idname, icon='DISK_DRIVE')
+        if cm_playback.player is None:
+            row.operator(cm_playback.SCENE_OT_cm_playback_start.bl_idname, icon='PLAY')
+        else:
+            row.operator(cm_playback.SCENE_OT_cm_playback_stop.bl_idname, icon='PAUSE')
+
+        if preferences.use_profiler:
+            row = layout.row()
+            row.operator(cm_profiler.SCENE_OT_cm_profiler_export.bl_idname, icon='TIME')
+
         row = layout.row()
         row.separator()
 
@@ -352,10 +486,13 @@ class SCENE_PT_CrowdMaster(Panel):
 
             box = layout.box()
             row = box.row()
-            row.label("You must have the Simplify Curves addon enabled and an agent selected.")
+            row.scale_y = 1.5
+            row.operator(cm_keyframes.SCENE_OT_cm_reduce_keyframes.bl_idname, icon="IPO")
             row = box.row()
             row.scale_y = 1.5
-            row.operator("graph.simplify", icon="IPO")
+            row.operator(cm_nla.SCENE_OT_cm_consolidate_nla.bl_idname, icon="NLA")
+            row = box.row()
+            row.operator(cm_brainCodegen.SCENE_OT_cm_brain_source.bl_idname, icon="TEXT")
 
 
 class SCENE_PT_CrowdMasterAgents(Panel):
@@ -457,6 +594,11 @@ def register():
 
     addon_updater_ops.register(bl_info)
     cm_prefs.register()
+    cm_profiler.register()
+    cm_keyframes.register()
+    cm_playback.register()
+    cm_nla.register()
+    cm_brainCodegen.register()
 
     bpy.utils.register_class(SCENE_UL_group)
     bpy.utils.register_class(SCENE_UL_agent_type)
@@ -464,7 +606,9 @@ def register():
     bpy.utils.register_class(SCENE_OT_cm_agent_add)
     bpy.utils.register_class(SCENE_OT_cm_agent_add_selected)
     bpy.utils.register_class(SCENE_OT_cm_start)
+    bpy.utils.register_class(SCENE_OT_cm_resume)
     bpy.utils.register_class(SCENE_OT_cm_stop)
+    bpy.utils.register_class(SCENE_OT_cm_batch_simulate)
     bpy.utils.register_class(SCENE_PT_CrowdMaster)
     bpy.utils.register_class(SCENE_PT_CrowdMasterAgents)
     bpy.utils.register_class(SCENE_PT_CrowdMasterManualAgents)
@@ -518,7 +662,9 @@ def unregister():
     bpy.utils.unregister_class(SCENE_OT_cm_agent_add)
     bpy.utils.unregister_class(SCENE_OT_cm_agent_add_selected)
     bpy.utils.unregister_class(SCENE_OT_cm_start)
+    bpy.utils.unregister_class(SCENE_OT_cm_resume)
     bpy.utils.unregister_class(SCENE_OT_cm_stop)
+    bpy.utils.unregister_class(SCENE_OT_cm_batch_simulate)
     bpy.utils.unregister_class(SCENE_PT_CrowdMaster)
     bpy.utils.unregister_class(SCENE_PT_CrowdMasterAgents)
     bpy.utils.unregister_class(SCENE_PT_CrowdMasterManualAgents)
@@ -533,6 +679,11 @@ def unregister():
     cm_generation.unregister()
     cm_utilities.unregister()
     cm_prefs.unregister()
+    cm_profiler.unregister()
+    cm_keyframes.unregister()
+    cm_playback.unregister()
+    cm_nla.unregister()
+    cm_brainCodegen.unregister()
 
     cm_nodeHUD.unregister()
 
@@ -19,25 +19,32 @@
 
 import bpy
 import mathutils
-import copy
 
 from .cm_compileBrain import compileBrain
+from .cm_agentStore import storeProperty
+from .cm_profiler import profiled
 
 
 class Agent:
-    """Represents each of the agents in the scene"""
-    def __init__(self, blenderid, nodeGroup, sim):
+    """Represents each of the agents in the scene. The position and rotation
+    data is held in the simulations AgentStore, this is a view onto one row
+    of it"""
+    def __init__(self, blenderid, nodeGroup, sim, clear=True):
         preferences = bpy.context.user_preferences.addons[__package__].preferences
         if preferences.show_debug_options:
             print("Blender id", blenderid)
         self.id = blenderid
-        self.brain = compileBrain(nodeGroup, sim, blenderid)
         self.sim = sim
+        self.store = sim.store
+        self.columns = self.store.columns
+        self.slot = self.store.allocate(blenderid)
+        self.brain = compileBrain(nodeGroup, sim, blenderid)
         self.external = {"id": self.id, "tags": {}}
-        """self.external modified by the agent and then coppied to self.access
-        at the end of the frame so that the updated values can be accessed by
-        other agents"""
-        self.access = copy.deepcopy(self.external)
+        """self.external modified by the agent and then swapped with
+        self.access at the end of the frame so that the updated values can be
+        accessed by other agents. The tags dict is never changed once it has
+        been published (see Brain.setTag) so the two can share it"""
+        self.access = {"id": self.id, "tags": self.external["tags"]}
         self.agvars = {"None": None}
         "agent variables. Don't access from other agents"
 
@@ -82,67 +89,151 @@ class Agent:
 
         self.globalVelocity = mathutils.Vector([0, 0, 0])
 
+        """The values keyed on frame 1"""
+        self.arxKeyed, self.aryKeyed, self.arzKeyed = self.arx, self.ary, self.arz
+        self.apxKeyed, self.apyKeyed, self.apzKeyed = self.apx, self.apy, self.apz
+
         """Clear out the nla"""
         objs = bpy.data.objects
 
-        objs[blenderid].animation_data_clear()
-        objs[blenderid].keyframe_insert(data_path="location", frame=1)
-        objs[blenderid].keyframe_insert(data_path="rotation_euler", frame=1)
-
-    def step(self):
-        objs = bpy.data.objects
-        preferences = bpy.context.user_preferences.addons[__package__].preferences
+        if clear:
+            objs[blenderid].animation_data_clear()
+            objs[blenderid].keyframe_insert(data_path="location", frame=1)
+            objs[blenderid].keyframe_insert(data_path="rotation_euler", frame=1)
+
+    arx = storeProperty("arx")
+    ary = storeProperty("ary")
+    arz = storeProperty("arz")
+    rx = storeProperty("rx")
+    ry = storeProperty("ry")
+    rz = storeProperty("rz")
+    rsx = storeProperty("rsx")
+    rsy = storeProperty("rsy")
+    rsz = storeProperty("rsz")
+
+    apx = storeProperty("apx")
+    apy = storeProperty("apy")
+    apz = storeProperty("apz")
+    px = storeProperty("px")
+    py = storeProperty("py")
+    pz = storeProperty("pz")
+    sx = storeProperty("sx")
+    sy = storeProperty("sy")
+    sz = storeProperty("sz")
+
+    arxKey = storeProperty("arxKey")
+    aryKey = storeProperty("aryKey")
+    arzKey = storeProperty("arzKey")
+    apxKey = storeProperty("apxKey")
+    apyKey = storeProperty("apyKey")
+    apzKey = storeProperty("apzKey")
+
+    arxKeyed = storeProperty("arxKeyed")
+    aryKeyed = storeProperty("aryKeyed")
+    arzKeyed = storeProperty("arzKeyed")
+    apxKeyed = storeProperty("apxKeyed")
+    apyKeyed = storeProperty("apyKeyed")
+    apzKeyed = storeProperty("apzKeyed")
+
+    radius = storeProperty("radius")
+
+    @property
+    def globalVelocity(self):
+        """The change in position for the last frame"""
+        st = self.store
+        sl = self.slot
+        return mathutils.Vector((st.gvx[sl], st.gvy[sl], st.gvz[sl]))
+
+    @globalVelocity.setter
+    def globalVelocity(self, value):
+        st = self.store
+        sl = self.slot
+        st.gvx[sl], st.gvy[sl], st.gvz[sl] = value[0], value[1], value[2]
+
+    def sync(self):
+        """Move the object to where the agent is. The keyframes are only
+        written every so often so the animation can't be relied on for this
+        while the simulation is running"""
+        obj = bpy.data.objects[self.id]
+        obj.rotation_euler = (self.arx, self.ary, self.arz)
+        obj.location = (self.apx, self.apy, self.apz)
 
+    def think(self):
+        """Evaluate the brain. The brain only sees the state of the other
+        agents from the end of the last frame so the agents can be evaluated
+        in any order (or in separate processes)"""
         self.brain.execute()
-        if objs[self.id].select:
-            if preferences.show_debug_options:
-                print("ID: ", self.id, "Tags: ", self.brain.tags,
-                      "outvars: ", self.brain.outvars)
-            # TODO show this in the UI
-        if objs[self.id] == bpy.context.active_object:
+        if bpy.data.objects[self.id] == bpy.context.active_object:
             self.brain.hightLight(bpy.context.scene.frame_current)
+        self.readBrain()
+
+    def skip(self):
+        """Used instead of think on the frames that the brain isn't evaluated
+        (see cm_lod). The tags that were published stay the same"""
+        self.external["tags"] = self.access["tags"]
+        self.brain.skip()
+
+    def extrapolate(self):
+        """Used instead of move on the frames that the brain isn't evaluated
+        (see cm_lod). Continues at the same velocity as the last frame"""
+        st = self.store
+        sl = self.slot
+        st.apx[sl] += st.gvx[sl]
+        st.apy[sl] += st.gvy[sl]
+        st.apz[sl] += st.gvz[sl]
+
+    def readBrain(self):
+        """Collect the tags and agent variables from the brain once it has
+        been evaluated"""
+        preferences = bpy.context.user_preferences.addons[__package__].preferences
+        if preferences.show_debug_options and bpy.data.objects[self.id].select:
+            print("ID: ", self.id, "Tags: ", self.brain.tags,
+                  "outvars: ", self.brain.outvars)
+            # TODO show this in the UI
 
-        self.rx = self.brain.outvars["rx"] if self.brain.outvars["rx"] else 0
-        self.ry = self.brain.outvars["ry"] if self.brain.outvars["ry"] else 0
-        self.rz = self.brain.outvars["rz"] if self.brain.outvars["rz"] else 0
-
-        self.arx += self.rx + self.rsx
-        self.rx = 0
+        self.external["tags"] = self.brain.tags
+        self.agvars = self.brain.agvars
 
-        self.ary += self.ry + self.rsy
-        self.ry = 0
+    def move(self):
+        """Use the outputs of the brain to update the position and rotation.
+        Called after every agent has thought"""
+        st = self.store
+        sl = self.slot
+        outvars = self.brain.outvars
 
-        self.arz += self.rz + self.rsz
-        self.rz = 0
+        rx = outvars["rx"] if outvars["rx"] else 0
+        ry = outvars["ry"] if outvars["ry"] else 0
+        rz = outvars["rz"] if outvars["rz"] else 0
 
-        self.px = self.brain.outvars["px"] if self.brain.outvars["px"] else 0
-        self.py = self.brain.outvars["py"] if self.brain.outvars["py"] else 0
-        self.pz = self.brain.outvars["pz"] if self.brain.outvars["pz"] else 0
+        arx = st.arx[sl] = st.arx[sl] + rx + st.rsx[sl]
+        ary = st.ary[sl] = st.ary[sl] + ry + st.rsy[sl]
+        arz = st.arz[sl] = st.arz[sl] + rz + st.rsz[sl]
+        st.rx[sl] = st.ry[sl] = st.rz[sl] = 0
 
-        self.external["tags"] = self.brain.tags
-        self.agvars = self.brain.agvars
+        px = st.px[sl] = outvars["px"] if outvars["px"] else 0
+        py = st.py[sl] = outvars["py"] if outvars["py"] else 0
+        pz = st.pz[sl] = outvars["pz"] if outvars["pz"] else 0
 
-        move = mathutils.Vector((self.px + self.sx,
-                                 self.py + self.sy,
-                                 self.pz + self.sz))
+        move = mathutils.Vector((px + st.sx[sl],
+                                 py + st.sy[sl],
+                                 pz + st.sz[sl]))
 
-        z = mathutils.Matrix.Rotation(-self.arz, 4, 'Z')
-        y = mathutils.Matrix.Rotation(-self.ary, 4, 'Y')
-        x = mathutils.Matrix.Rotation(-self.arx, 4, 'X')
+        z = mathutils.Matrix.Rotation(-arz, 4, 'Z')
+        y = mathutils.Matrix.Rotation(-ary, 4, 'Y')
+        x = mathutils.Matrix.Rotation(-arx, 4, 'X')
 
         rotation = x * y * z
         result = move * rotation
 
-        self.globalVelocity = result
+        st.gvx[sl], st.gvy[sl], st.gvz[sl] = result[0], result[1], result[2]
 
-        self.apx += result[0]
-
-        self.apy += result[1]
-
-        self.apz += result[2]
+        st.apx[sl] += result[0]
+        st.apy[sl] += result[1]
+        st.apz[sl] += result[2]
 
+    @profiled("Agent.apply", "keyframes")
     def apply(self):
-        """Called in single thread after all agent.step() calls are done"""
+        """Called in single thread after all agent.move() calls are done"""
         obj = bpy.data.objects[self.id]
 
         if obj.animation_data:
@@ -151,87 +242,51 @@ class Agent:
             for track in obj.animation_data.nla_tracks:
                 track.mute = False
 
-        """Set objects rotation and location"""
-
-        if abs(self.arx - obj.rotation_euler[0]) > 0.000001:
-            if not self.arxKey:
-                obj.keyframe_insert(data_path="rotation_euler",
-                                    index=0,
-                                    frame=bpy.context.scene.frame_current-1)
-                self.arxKey = True
-            obj.rotation_euler[0] = self.arx
-            obj.keyframe_insert(data_path="rotation_euler",
-                                index=0,
-                                frame=bpy.context.scene.frame_current)
-        else:
-            self.arxKey = False
-
-        if abs(self.ary - obj.rotation_euler[1]) > 0.000001:
-            if not self.aryKey:
-                obj.keyframe_insert(data_path="rotation_euler",
-                                    index=1,
-                                    frame=bpy.context.scene.frame_current-1)
-                self.aryKey = True
-            obj.rotation_euler[1] = self.ary
-            obj.keyframe_insert(data_path="rotation_euler",
-                                index=1,
-                                frame=bpy.context.scene.frame_current)
-        else:
-            self.aryKey = False
-
-        if abs(self.arz - obj.rotation_euler[2]) > 0.000001:
-            if not self.arzKey:
-                obj.keyframe_insert(data_path="rotation_euler",
-                                    index=2,
-                                    frame=bpy.context.scene.frame_current-1)
-                self.arzKey = True
-            obj.rotation_euler[2] = self.arz
-            obj.keyframe_insert(data_path="rotation_euler",
-                                index=2,
-                                frame=bpy.context.scene.frame_current)
-        else:
-            self.arzKey = False
-
-        if abs(self.apx - obj.location[0]) > 0.000001:
-            if not self.apxKey:
-                obj.keyframe_insert(data_path="location",
-                                    index=0,
-                                    frame=bpy.context.scene.frame_current-1)
-                self.apxKey = True
-            obj.location[0] = self.apx
-            obj.keyframe_insert(data_path="location",
-                                index=0,
-                                frame=bpy.context.scene.frame_current)
-        else:
-            self.apxKey = False
-
-        if abs(self.apy - obj.location[1]) > 0.000001:
-            if not self.apyKey:
-                obj.keyframe_insert(data_path="location",
-                                    index=1,
-                                    frame=bpy.context.scene.frame_current-1)
-                self.apyKey = True
-            obj.location[1] = self.apy
-            obj.keyframe_insert(data_path="location",
-                                index=1,
-                                frame=bpy.context.scene.frame_current)
-        else:
-            self.apyKey = False
-
-        if abs(self.apz - obj.location[2]) > 0.000001:
-            if not self.apzKey:
-                obj.keyframe_insert(data_path="location",
-                                    index=2,
-                                    frame=bpy.context.scene.frame_current-1)
-                self.apzKey = True
-            obj.location[2] = self.apz
-            obj.keyframe_insert(data_path="location",
-                                index=2,
-                                frame=bpy.context.scene.frame_current)
-        else:
-            self.apzKey = False
-
-        self.access = copy.deepcopy(self.external)
+        """Key the objects rotation and location"""
+        self.sim.keyframes.key(self.slot, bpy.context.scene.frame_current)
+
+        self.publish()
+
+    def publish(self):
+        """Make this frames tags visible to the other agents. The brain copies
+        the tags before changing them so unless they were changed this frame
+        there is nothing to do, otherwise the front and back are swapped"""
+        if self.external["tags"] is not self.access["tags"]:
+            self.access, self.external = self.external, self.access
+
+    def getState(self):
+        """Everything about this agent (other than the values in the
+        AgentStore) that changes during the simulation"""
+        return {"access": self.access,
+                "agvars": self.agvars,
+                "brain": self.brain.getState()}
+
+    def setState(self, state):
+        """Restore the values returned by getState"""
+        self.brain.setState(state["brain"])
+        self.access = state["access"]
+        self.external["tags"] = self.brain.tags
+        self.agvars = state["agvars"]
+
+    def truncateAnimation(self, frame):
+        """Remove the keyframes and action strips after frame so that the
+        simulation can continue from there"""
+        obj = bpy.data.objects[self.id]
+        anim = obj.animation_data
+        if anim is None:
+            return
+        if anim.action:
+            for fc in anim.action.fcurves:
+                late = [k for k in fc.keyframe_points if k.co[0] > frame]
+                for k in reversed(late):
+                    fc.keyframe_points.remove(k, fast=True)
+                fc.update()
+        for track in list(anim.nla_tracks):
+            for strip in list(track.strips):
+                if strip.frame_start > frame:
+                    track.strips.remove(strip)
+            if len(track.strips) == 0:
+                anim.nla_tracks.remove(track)
 
     def highLight(self):
         for n in self.brain.neurons.values():
@@ -0,0 +1,102 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+from array import array
+
+"""ar - absolute rot, r - change rot by, rs - rot speed
+ap - absolute pos, p - change pos by, s - speed
+gv - global velocity (the change in position for the last frame)
+Keyed - the value of the last keyframe set (see cm_keyframes)"""
+FLOATCOLUMNS = ("arx", "ary", "arz",
+                "rx", "ry", "rz",
+                "rsx", "rsy", "rsz",
+                "apx", "apy", "apz",
+                "px", "py", "pz",
+                "sx", "sy", "sz",
+                "gvx", "gvy", "gvz",
+                "arxKeyed", "aryKeyed", "arzKeyed",
+                "apxKeyed", "apyKeyed", "apzKeyed",
+                "radius")
+
+"""True if a keyframe was set last frame"""
+FLAGCOLUMNS = ("arxKey", "aryKey", "arzKey",
+               "apxKey", "apyKey", "apzKey")
+
+"""lodInterval - the number of frames between evaluations of the brain"""
+INTCOLUMNS = ("lodInterval",)
+
+
+class AgentStore:
+    """The state of every agent in the simulation stored as contiguous arrays.
+    Each agent owns one slot (the same index in every column)"""
+    def __init__(self):
+        self.names = []  # type: List[str] - name of the agent in each slot
+        self.slots = {}  # type: Dict[str, int]
+        self.columns = {}  # type: Dict[str, array] - every column by name
+        for col in FLOATCOLUMNS:
+            self.columns[col] = array('d')
+        for col in FLAGCOLUMNS:
+            self.columns[col] = array('b')
+        for col in INTCOLUMNS:
+            self.columns[col] = array('i')
+        # The arrays are only ever grown in place so they can be bound once
+        for col, arr in self.columns.items():
+            setattr(self, col, arr)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def reserve(self, count):
+        """Grow every column by count slots. Done once per group of agents
+        so that the arrays aren't resized for every agent"""
+        for col in FLOATCOLUMNS:
+            getattr(self, col).extend(array('d', [0.0]) * count)
+        for col in FLAGCOLUMNS:
+            getattr(self, col).extend(array('b', [1]) * count)
+        for col in INTCOLUMNS:
+            getattr(self, col).extend(array('i', [1]) * count)
+        self.names.extend([None] * count)
+
+    def allocate(self, name):
+        """Give an agent a slot, reserving more space if needed
+
+        :returns: the slot for the agent
+        :rtype: int"""
+        if name in self.slots:
+            return self.slots[name]
+        slot = len(self.slots)
+        if slot >= len(self.names):
+            self.reserve(1)
+        self.names[slot] = name
+        self.slots[name] = slot
+        return slot
+
+
+def storeProperty(column):
+    """Create a property that reads and writes one column of the AgentStore
+    for the slot of the object it is accessed through. The object must have
+    the columns dict of the store as self.columns. Code that runs for every
+    agent every frame should index the columns directly instead"""
+    def getter(self):
+        return self.columns[column][self.slot]
+
+    def setter(self, value):
+        self.columns[column][self.slot] = value
+
+    return property(getter, setter)
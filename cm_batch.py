@@ -0,0 +1,57 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""Run a CrowdMaster simulation from the command line. The addon must be
+enabled in the user preferences of the Blender that is used. eg.
+
+blender -b shot.blend -P cm_batch.py -- --start 1 --end 1200 --save
+"""
+
+import argparse
+import sys
+
+import bpy
+
+
+def parseArgs(argv):
+    if "--" in argv:
+        argv = argv[argv.index("--") + 1:]
+    else:
+        argv = []
+    parser = argparse.ArgumentParser(description="CrowdMaster batch simulation")
+    parser.add_argument("--start", type=int, default=-1,
+                        help="First frame (defaults to the scene start)")
+    parser.add_argument("--end", type=int, default=-1,
+                        help="Last frame (defaults to the scene end)")
+    parser.add_argument("--save", action="store_true",
+                        help="Save the .blend file when finished")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parseArgs(sys.argv)
+    result = bpy.ops.scene.cm_batch_simulate(frameStart=args.start,
+                                             frameEnd=args.end,
+                                             save=args.save)
+    if 'FINISHED' not in result:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,15 @@
 # along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
 # ##### END GPL LICENSE BLOCK #####
 
-import random
-
 import bpy
 
 import mathutils
 
+from . import cm_profiler
+from .cm_impulse import toImpulse
+from .cm_random import counterRandom, randomKey
+from .cm_telemetry import Telemetry, outputColour, stateColour
+
 
 class Neuron():
     """The representation of the nodes. Not to be used on own"""
@@ -31,23 +34,25 @@ class Neuron():
         self.neurons = self.brain.neurons  # type: List[Neuron]
         self.inputs = []  # type: List[str] - strings are names of neurons
         self.result = None  # type: None | ImpulseContainer - Cache for current
-        self.resultLog = [(0, 0, 0), (0, 0, 0)]  # type: List[(int, int, int)]
-        self.fillOutput = bpy.props.BoolProperty(default=True)
+        self.evaluated = False  # True once result is set for this frame
         self.bpyNode = bpyNode  # type: cm_bpyNodes.LogicNode
         self.settings = {}  # type: Dict[str, bpy.props.*]
         self.dependantOn = []  # type: List[str] - strings are names of neurons
+        self.inputNeurons = []  # type: List[Neuron] - set by link
+        self.guards = []  # type: List[State] - set by link
+        self.randomKey = 0  # set by BrainProgram.instantiate (see cm_random)
 
     def evaluate(self):
-        """Called by any neurons that take this neuron as an input"""
-        preferences = bpy.context.user_preferences.addons[__package__].preferences
-        if self.result:
+        """Called by any neurons that take this neuron as an input. Brains
+        are run with a plan (see Brain.plans) so this only needs to work out the
+        neurons that haven't been run yet"""
+        if self.evaluated:
             # Return a cached version of the answer if possible
             return self.result
-        noDeps = len(self.dependantOn) == 0
-        dep = True in [self.neurons[x].isCurrent for x in self.dependantOn]
+        guards = self.guards
         # Only output something if the node isn't dependant on a state
         #  or if one of it's dependancies is the current state
-        if noDeps or dep:
+        if not guards or any(g.isCurrent for g in guards):
             inps = []
             for i in self.inputs:
                 got = self.neurons[i].evaluate()
@@ -55,55 +60,68 @@ class Neuron():
                 input in not a dictionary then it is made into one"""
                 if got is not None:
                     inps.append(got)
-            output = self.core(inps, self.settings)
-            if not (isinstance(output, dict) or output is None):
-                output = {"None": output}
+            output = self.compute(inps)
         else:
             output = None
         self.result = output
+        self.evaluated = True
+        self.logResult(output)
+        return output
 
-        # Calculate the colour that would be displayed in the agent is selected
-        total = 0
-        if output:
-            val = 1
-            av = sum(output.values()) / len(output)
-            if av > 0:
-                startHue = 0.333
-            else:
-                startHue = 0.5
-
-            if av > 1:
-                hueChange = -(-(abs(av)+1)/abs(av) + 2) * (1/3)
-                hue = 0.333 + hueChange
-                sat = 1
-            elif av < -1:
-                hueChange = (-(abs(av)+1)/abs(av) + 2) * (1/3)
-                hue = 0.5 + hueChange
-                sat = 1
-            else:
-                hue = startHue
+    def link(self):
+        """Look up the neurons that are inputs and the states this neuron
+        depends on. Called once all the neurons of the brain exist"""
+        self.inputNeurons = [self.neurons[i] for i in self.inputs
+                             if i in self.neurons]
+        self.guards = [self.neurons[x] for x in self.dependantOn
+                       if x in self.neurons]
+
+    def run(self):
+        """Step of the brains plan. The plan is in topological order so the
+        results of all the inputs are already known, and only contains this
+        neuron if the current state is one that it is dependant on"""
+        output = self.compute([n.result for n in self.inputNeurons
+                               if n.result is not None])
+        self.result = output
+        self.evaluated = True
+        self.logResult(output)
+
+    def runGuarded(self):
+        """run for when the current state hasn't been checked"""
+        guards = self.guards
+        if guards and not any(g.isCurrent for g in guards):
+            self.result = None
+            self.evaluated = True
+            self.logResult(None)
+        else:
+            self.run()
 
-            if abs(av) < 1:
-                sat = abs(av)**(1/2)
-            else:
-                sat = 1
+    def compute(self, inps):
+        prof = cm_profiler.activeProfiler
+        if prof is None:
+            output = self.core(inps, self.settings)
         else:
-            hue = 0
-            sat = 0
-            val = 0.5
-        self.resultLog[-1] = (hue, sat, val)
+            start = cm_profiler.clock()
+            output = self.core(inps, self.settings)
+            prof.add("neuron", self.__class__.__name__, start,
+                     cm_profiler.clock())
+        return toImpulse(output)
 
-        return output
+    def logResult(self, output):
+        """Record the output if the telemetry of this agent is recorded"""
+        telemetry = self.brain.telemetry
+        if telemetry is not None:
+            telemetry.record(self, output)
 
     def newFrame(self):
         self.result = None
-        self.resultLog.append((0, 0, 0.5))
+        self.evaluated = False
 
     def highLight(self, frame):
         """Colour the nodes in the interface to reflect the output"""
         preferences = bpy.context.user_preferences.addons[__package__].preferences
         if preferences.use_node_color:
-            hue, sat, val = self.resultLog[frame]
+            hue, sat, val = outputColour(self.brain.recorded(frame, self))
             self.bpyNode.use_custom_color = True
             c = mathutils.Color()
             c.hsv = hue, sat, val
@@ -116,6 +134,7 @@ class State:
     def __init__(self, brain, bpyNode, name):
         """A lot of the fields are modified by the compileBrain function"""
         self.name = name
+        self.randomKey = randomKey(name)
         self.brain = brain
         self.neurons = self.brain.neurons
         self.outputs = []
@@ -130,7 +149,6 @@ class State:
         self.currentFrame = 0
 
         self.bpyNode = bpyNode
-        self.resultLog = {0: (0, 0, 0), 1: (0, 0, 0)}
 
     def query(self):
         """If this state is a valid next move return float > 0"""
@@ -151,7 +169,7 @@ class State:
         if len(self.valueInputs) == 0:
             self.finalValue = self.settings["ValueDefault"]
             if self.settings["RandomInput"]:
-                self.finalValue += random.random()
+                self.finalValue += self.brain.random(self.randomKey)
             return
         values = []
         for inp in self.valueInputs:
@@ -180,7 +198,7 @@ class State:
             result = min(vals)
         self.finalValue = result
         if self.settings["RandomInput"]:
-            self.finalValue += random.random()
+            self.finalValue += self.brain.random(self.randomKey)
 
     def evaluateState(self):
         """Return the state to move to (allowed to return itself)
@@ -196,8 +214,7 @@ class State:
         else:
             complete = self.currentFrame/self.length
             complete = 0.5 + complete/2
-        sceneFrame = bpy.context.scene.frame_current
-        self.resultLog[sceneFrame] = ((0.15, 0.4, complete))
+        self.logComplete(complete)
 
         if self.currentFrame < self.length - 1:
             return False, self.name
@@ -227,18 +244,31 @@ class State:
 
         return False, None
 
+    def logComplete(self, complete):
+        """Record how far through the state is if the telemetry of this agent
+        is recorded"""
+        telemetry = self.brain.telemetry
+        if telemetry is not None:
+            telemetry.record(self, complete)
+
     def newFrame(self):
         self.finalValueCalcd = False
 
+    def getState(self):
+        """The parts of this state that change during the simulation"""
+        return (self.currentFrame, self.isCurrent, self.length,
+                getattr(self, "actionName", None))
+
+    def setState(self, state):
+        """Restore the values returned by getState"""
+        self.currentFrame, self.isCurrent, self.length, actionName = state
+        if actionName is not None:
+            self.actionName = actionName
+
     def highLight(self, frame):
         preferences = bpy.context.user_preferences.addons[__package__].preferences
         if preferences.use_node_color:
-            if frame in self.resultLog:
-                hue, sat, val = self.resultLog[frame]
-            else:
-                hue = 0.0
-                sat = 0.0
-                val = 1.0
+            hue, sat, val = stateColour(self.brain.recorded(frame, self))
             self.bpyNode.use_custom_color = True
             c = mathutils.Color()
             c.hsv = hue, sat, val
@@ -255,7 +285,12 @@ class Brain():
         self.lvars = self.sim.lvars
         self.outvars = {}
         self.tags = {}
+        self.tagsOwned = False  # False while self.tags is the published dict
         self.isActiveSelection = False
+        self.slot = 0
+        self.draws = {}  # {random key: numbers drawn this frame}
+        self.telemetry = None  # The Telemetry being recorded this frame
+        self.telemetryLog = None  # The Telemetry of the frames recorded
 
         self.currentState = None
         self.startState = None
@@ -264,6 +299,28 @@ class Brain():
         self.outputs = []
         self.neurons = {}
         self.states = []
+        self.program = None  # The BrainProgram this brain was created from
+        self.plans = {}
+        """{name of the current state or None: [step]} The run methods of the
+        neurons (and evaluate methods of the states) that can output
+        something while that state is current, in an order where every
+        neuron comes after its inputs"""
+
+    def setTag(self, tag, value):
+        """Add or change a tag. self.tags is shared with what the other
+        agents can see so it is copied before the first change each frame"""
+        if not self.tagsOwned:
+            self.tags = dict(self.tags)
+            self.tagsOwned = True
+        self.tags[tag] = value
+
+    def removeTag(self, tag):
+        """Remove a tag if it exists (see setTag)"""
+        if tag in self.tags:
+            if not self.tagsOwned:
+                self.tags = dict(self.tags)
+                self.tagsOwned = True
+            del self.tags[tag]
 
     def setStartState(self, stateNode):
         """Used by compileBrian"""
@@ -273,24 +330,80 @@ class Brain():
     def reset(self):
         self.outvars = {"rx": 0, "ry": 0, "rz": 0,
                         "px": 0, "py": 0, "pz": 0}
-        self.tags = self.sim.agents[self.userid].access["tags"]
-        self.agvars = self.sim.agents[self.userid].agvars
+        agent = self.sim.agents[self.userid]
+        self.tags = agent.access["tags"]
+        self.tagsOwned = False
+        self.agvars = agent.agvars
+        self.slot = agent.slot
+        self.draws.clear()
 
     def execute(self):
         """Called for each time the agents needs to evaluate"""
+        self.begin()
+        self.setUser()
+        for step in self.plans[self.activeState()]:
+            step()
+        self.finish()
+
+    def skip(self):
+        """Called instead of execute on the frames that the brain isn't
+        evaluated (see cm_lod). The current state carries on so that it ends
+        at the same time as its action, but it can only move to the next
+        state once the brain is evaluated again (so up to the LOD interval
+        late)"""
+        state = self.neurons.get(self.currentState)
+        if state is not None and state.isCurrent:
+            if state.currentFrame < state.length - 2:
+                state.currentFrame += 1
+
+    def activeState(self):
+        """The name of the state that is current. None on the first frame
+        as the start state isn't current until it has been evaluated"""
+        if self.currentState and self.neurons[self.currentState].isCurrent:
+            return self.currentState
+        return None
+
+    def begin(self):
+        """Get ready to evaluate a new frame"""
         actv = bpy.context.active_object
         self.isActiveSelection = actv is not None and actv.name == self.userid
         self.reset()
-        randstate = hash(self.userid) + self.sim.framelast
-        random.seed(randstate)
-        for name, var in self.lvars.items():
-            var.setuser(self.userid)
+        if self.userid in self.sim.recording:
+            if self.telemetryLog is None:
+                self.telemetryLog = Telemetry(self.sim.telemetryFrames)
+            self.telemetryLog.newFrame(self.sim.recordFrame)
+            self.telemetry = self.telemetryLog
+        else:
+            self.telemetry = None
         for neur in self.neurons.values():
             neur.newFrame()
-        for out in self.outputs:
-            self.neurons[out].evaluate()
+
+    def random(self, key):
+        """A random number in the range [0, 1) for the node with randomKey
+        key. Different for each call in a frame but the same every time the
+        simulation is run (see cm_random)"""
+        draw = self.draws.get(key, 0)
+        self.draws[key] = draw + 1
+        return counterRandom(self.sim.randomSeed, self.slot,
+                             self.sim.framelast, key, draw)
+
+    def setUser(self):
+        """Make the channels answer for this agent"""
+        for name, var in self.lvars.items():
+            var.setuser(self.userid)
+
+    def finish(self):
+        """Move the state machine on once the neurons have been evaluated"""
         if self.currentState:
-            new, nextState = self.neurons[self.currentState].evaluateState()
+            state = self.neurons[self.currentState]
+            prof = cm_profiler.activeProfiler
+            if prof is None:
+                new, nextState = state.evaluateState()
+            else:
+                start = cm_profiler.clock()
+                new, nextState = state.evaluateState()
+                prof.add("state", state.__class__.__name__, start,
+                         cm_profiler.clock())
             self.neurons[self.currentState].isCurrent = False
             if nextState is None:
                 nextState = self.startState
@@ -299,6 +412,34 @@ class Brain():
             if new:
                 self.neurons[nextState].moveTo()
 
+    def getState(self):
+        """Everything that evaluating this brain changes. Used to move the
+        results of brains evaluated in other processes back to the main one"""
+        states = {}
+        for name, neur in self.neurons.items():
+            if isinstance(neur, State):
+                states[name] = neur.getState()
+        return {"outvars": self.outvars,
+                "tags": self.tags,
+                "agvars": self.agvars,
+                "currentState": self.currentState,
+                "states": states}
+
+    def setState(self, state):
+        """Restore the values returned by getState"""
+        self.outvars = state["outvars"]
+        self.tags = state["tags"]
+        self.agvars = state["agvars"]
+        self.currentState = state["currentState"]
+        for name, st in state["states"].items():
+            self.neurons[name].setState(st)
+
+    def recorded(self, frame, node):
+        """The value recorded for a neuron or state on frame (or None)"""
+        if self.telemetryLog is None:
+            return None
+        return self.telemetryLog.get(frame, node)
+
     def hightLight(self, frame):
         """This will be called for the agent that is the active selection"""
         for n in self.neurons.values():
@@ -0,0 +1,294 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""Generates a Python function for each compiled brain.
+
+The function does the same as running the plan of the brain (see
+Brain.plans) but the settings of the common nodes are written into the code
+as constants and the results are passed between nodes in local variables.
+The results are the same impulses (see cm_impulse) that Neuron.compute
+returns. Nodes without a generator here call Neuron.compute as normal"""
+
+import linecache
+import math
+
+import bpy
+from bpy.types import Operator
+
+from .cm_impulse import IMPULSES, SingleImpulse, mapImpulses, toImpulse
+from .cm_nodeFunctions import (LogicGRAPH, LogicMATH, LogicMAP, LogicSTRONG,
+                               LogicWEAK, LogicAND, LogicOR, LogicOUTPUT,
+                               LogicCONSTANT)
+
+
+def elementwise(expression):
+    """Lines for a node that applies expression (of v) to every value. The
+    last input with a key wins"""
+    return ["out = mapImpulses(inps, lambda v: {})".format(expression)]
+
+
+def genGRAPH(s):
+    if s["CurveType"] == "RBF":
+        a = math.log(0.1) / (s["RBFTenPP"]**2)
+        value = "math.e**({!r}*(v - {!r})**2)".format(a, s["RBFMiddle"])
+    elif s["CurveType"] == "RANGE":
+        lz, lo, uo, uz = (s["LowerZero"], s["LowerOne"], s["UpperOne"],
+                          s["UpperZero"])
+        value = ("(0 if v < {!r} else (v - {!r}) / {!r} if v < {!r} else "
+                 "1 if v <= {!r} else ({!r} - v) / {!r} if v < {!r} else "
+                 "0)").format(lz, lz, lo - lz, lo, uo, uz, uz - uo, uz)
+    else:
+        return ["out = toImpulse({})"]
+    # The first input with a key wins
+    return ["curve = lambda v: {} * {!r}".format(value, s["Multiply"]),
+            "if len(inps) == 1 and isinstance(inps[0], IMPULSES):",
+            "    out = inps[0].map(curve)",
+            "else:",
+            "    out = {}",
+            "    for into in inps:",
+            "        for i, v in into.items():",
+            "            if i not in out:",
+            "                out[i] = curve(v)",
+            "    out = toImpulse(out)"]
+
+
+def genMATH(s):
+    ops = {"add": "+", "sub": "-", "mul": "*", "div": "/"}
+    if s["operation"] not in ops:
+        return ["out = toImpulse({})"]
+    return elementwise("v {} {!r}".format(ops[s["operation"]], s["num1"]))
+
+
+def genMAP(s):
+    li, ui = s["LowerInput"], s["UpperInput"]
+    lo, uo = s["LowerOutput"], s["UpperOutput"]
+    if li == ui:
+        return ["out = toImpulse({})"]
+    return elementwise("{!r} * (v - {!r}) + {!r}".format((uo - lo) / (ui - li),
+                                                         li, lo))
+
+
+def genSTRONG(s):
+    return elementwise("v**2 * (-2*v + 3)")
+
+
+def genWEAK(s):
+    return elementwise("2*v - (v**2 * (-2*v + 3))")
+
+
+def genAND(s):
+    if s["SingleOutput"]:
+        return None
+    combine = "out[i] *= v" if s["Method"] == "MUL" else "out[i] = min(out[i], v)"
+    lines = ["out = {}",
+             "for into in inps:",
+             "    for i, v in into.items():",
+             "        if i in out:",
+             "            " + combine]
+    if s["IncludeAll"]:
+        lines += ["        elif all(i in b for b in inps):",
+                  "            out[i] = v"]
+    else:
+        lines += ["        else:",
+                  "            out[i] = v"]
+    return lines + ["out = toImpulse(out)"]
+
+
+def genOR(s):
+    if s["SingleOutput"]:
+        return None
+    if s["Method"] == "MUL":
+        combine = "out[i] *= (1-v)"
+    else:
+        combine = "out[i] = min(1-out[i], 1-v)"
+    return ["out = {}",
+            "for into in inps:",
+            "    for i, v in into.items():",
+            "        if i in out:",
+            "            " + combine,
+            "        else:",
+            "            out[i] = (1-v)",
+            "out = toImpulse({k: 1-v for k, v in out.items()})"]
+
+
+def genOUTPUT(s):
+    kind = s["MultiInputType"]
+    if kind == "AVERAGE":
+        lines = ["total = 0",
+                 "count = 0",
+                 "for into in inps:",
+                 "    for v in into.values():",
+                 "        total += v",
+                 "        count += 1",
+                 "val = total / max(1, count)"]
+    elif kind == "MAX":
+        lines = ["val = 0",
+                 "for into in inps:",
+                 "    for v in into.values():",
+                 "        if abs(v) > abs(val):",
+                 "            val = v"]
+    elif kind == "SUM":
+        lines = ["val = 0",
+                 "for into in inps:",
+                 "    for v in into.values():",
+                 "        val += v"]
+    else:
+        return None
+    return lines + ["brain.outvars[{!r}] = val".format(s["Output"]),
+                    "out = SingleImpulse(val)"]
+
+
+def genCONSTANT(s):
+    value = s["Value"]
+    if value is None:
+        return ["out = None"]
+    if isinstance(value, SingleImpulse) and math.isfinite(value.value):
+        return ["out = SingleImpulse({!r})".format(value.value)]
+    # Containers are shared by every call through Neuron.compute (they can't
+    # be changed) and repr of inf and nan isn't valid code
+    return None
+
+
+GENERATORS = {LogicCONSTANT: genCONSTANT,
+              LogicGRAPH: genGRAPH,
+              LogicMATH: genMATH,
+              LogicMAP: genMAP,
+              LogicSTRONG: genSTRONG,
+              LogicWEAK: genWEAK,
+              LogicAND: genAND,
+              LogicOR: genOR,
+              LogicOUTPUT: genOUTPUT}
+
+
+def indent(lines, depth):
+    return ["    " * depth + line for line in lines]
+
+
+def generateSource(program, state):
+    """The source of a function run(brain, N) that evaluates the brain while
+    state is the current state. N is the neurons of the brain in the order
+    of program.nodes. The neurons that are dependant on other states are
+    left out as they would output None"""
+    index = {spec.name: i for i, spec in enumerate(program.nodes)}
+    specs = {spec.name: spec for spec in program.nodes}
+    local = {}  # {neuron name: local variable holding its result}
+
+    lines = ["def run(brain, N):",
+             "    # Brain {!r} while {!r} is the current state".format(
+                 program.name, state),
+             "    T = brain.telemetry"]
+    if program.folded:
+        lines.append("    # Folded into constants: {!r}".format(program.folded))
+    if program.removed:
+        lines.append("    # Removed as unused: {!r}".format(program.removed))
+    for name in program.statePlans[state]:
+        spec = specs[name]
+        i = index[name]
+        lines.append("    # {!r} ({})".format(name, spec.neuronType.__name__))
+        if spec.isState:
+            lines.append("    N[{}].evaluate()".format(i))
+            continue
+
+        inputs = [local[inp] for inp in spec.inputs if inp in local]
+        if len(inputs) == 0:
+            body = ["inps = []"]
+        elif len(inputs) == 1:
+            body = ["inps = [] if {0} is None else [{0}]".format(inputs[0])]
+        else:
+            body = ["inps = [x for x in ({}) if x is not None]".format(
+                "".join(x + ", " for x in inputs))]
+        generator = GENERATORS.get(spec.neuronType)
+        generated = generator(spec.settings) if generator else None
+        if generated is None:
+            body.append("out = N[{}].compute(inps)".format(i))
+        else:
+            body += generated
+        lines += indent(body, 1)
+        var = "r{}".format(i)
+        local[name] = var
+        lines += ["    {} = out".format(var),
+                  "    n = N[{}]".format(i),
+                  "    n.result = out",
+                  "    n.evaluated = True",
+                  "    if T is not None:",
+                  "        T.record(n, out)"]
+    return "\n".join(lines) + "\n"
+
+
+def compileSource(program):
+    """Compile the generated source of a program for each state. Registered
+    with linecache so that tracebacks from the generated code show the line
+
+    :returns: {state: source}, {state: function}"""
+    sources = {}
+    functions = {}
+    for state in program.statePlans:
+        source = generateSource(program, state)
+        filename = "<CrowdMaster brain {} state {}>".format(program.name,
+                                                           state)
+        linecache.cache[filename] = (len(source), None,
+                                     source.splitlines(True), filename)
+        namespace = {"math": math, "IMPULSES": IMPULSES,
+                     "SingleImpulse": SingleImpulse,
+                     "mapImpulses": mapImpulses, "toImpulse": toImpulse}
+        exec(compile(source, filename, "exec"), namespace)
+        sources[state] = source
+        functions[state] = namespace["run"]
+    return sources, functions
+
+
+class SCENE_OT_cm_brain_source(Operator):
+    """Show the code generated for the brain in the active node editor in a
+    text block"""
+    bl_idname = "scene.cm_brain_source"
+    bl_label = "Show Generated Brain Code"
+
+    @classmethod
+    def poll(cls, context):
+        space = context.space_data
+        return (space is not None and space.type == 'NODE_EDITOR' and
+                space.node_tree is not None and
+                space.node_tree.bl_idname == "CrowdMasterTreeType")
+
+    def execute(self, context):
+        from .cm_compileBrain import compileProgram
+        nodeGroup = context.space_data.node_tree
+        program = compileProgram(nodeGroup)
+        source = "\n\n".join(generateSource(program, state)
+                              for state in program.statePlans)
+        if program.folded or program.removed:
+            source = "# " + program.report() + "\n\n" + source
+        textName = "CrowdMaster {}.py".format(nodeGroup.name)
+        text = bpy.data.texts.get(textName)
+        if text is None:
+            text = bpy.data.texts.new(textName)
+        text.clear()
+        text.write(source)
+        if program.folded or program.removed:
+            self.report({'INFO'}, program.report())
+        self.report({'INFO'}, "Generated code written to " + textName)
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(SCENE_OT_cm_brain_source)
+
+
+def unregister():
+    bpy.utils.unregister_class(SCENE_OT_cm_brain_source)
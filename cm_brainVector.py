@@ -0,0 +1,420 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""Evaluates the brains of all the agents that share a node group together.
+
+The plan of the brain is split into stages. The nodes in a vector stage are
+evaluated once for every agent at the same time, the nodes in the other
+stages are evaluated one agent at a time as normal. A vector node only uses
+its kernel for the agents where all of its inputs are single values (which
+is what most input nodes produce), any other agents fall back to
+Neuron.run. numpy is used for the kernels if it is available"""
+
+import math
+
+from .cm_brainClasses import State
+from .cm_nodeFunctions import (LogicGRAPH, LogicMATH, LogicMAP, LogicSTRONG,
+                               LogicWEAK, LogicAND, LogicOR)
+from .cm_impulse import SingleImpulse
+from .cm_profiler import section
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def graphScalar(vals, settings):
+    # Only the first input is used (see LogicGRAPH)
+    value = vals[0]
+    if settings["CurveType"] == "RBF":
+        a = math.log(0.1) / (settings["RBFTenPP"]**2)
+        result = math.e**(a*(value - settings["RBFMiddle"])**2)
+    else:
+        lz = settings["LowerZero"]
+        lo = settings["LowerOne"]
+        uo = settings["UpperOne"]
+        uz = settings["UpperZero"]
+        if value < lz:
+            result = 0
+        elif value < lo:
+            result = (value - lz) / (lo - lz)
+        elif value <= uo:
+            result = 1
+        elif value < uz:
+            result = (uz - value) / (uz - uo)
+        else:
+            result = 0
+    return result * settings["Multiply"]
+
+
+def graphArray(cols, settings):
+    value = cols[0]
+    if settings["CurveType"] == "RBF":
+        a = math.log(0.1) / (settings["RBFTenPP"]**2)
+        result = np.exp(a*(value - settings["RBFMiddle"])**2)
+    else:
+        lz = settings["LowerZero"]
+        lo = settings["LowerOne"]
+        uo = settings["UpperOne"]
+        uz = settings["UpperZero"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rising = (value - lz) / (lo - lz)
+            falling = (uz - value) / (uz - uo)
+        result = np.where(value < lz, 0.0,
+                          np.where(value < lo, rising,
+                                   np.where(value <= uo, 1.0,
+                                            np.where(value < uz, falling,
+                                                     0.0))))
+    return result * settings["Multiply"]
+
+
+def mathKernel(vals, settings):
+    # The last input overwrites the others (see LogicMATH)
+    value = vals[-1]
+    op = settings["operation"]
+    if op == "add":
+        return value + settings["num1"]
+    elif op == "sub":
+        return value - settings["num1"]
+    elif op == "mul":
+        return value * settings["num1"]
+    return value / settings["num1"]
+
+
+def mapKernel(vals, settings):
+    li = settings["LowerInput"]
+    ui = settings["UpperInput"]
+    lo = settings["LowerOutput"]
+    uo = settings["UpperOutput"]
+    return ((uo - lo) / (ui - li)) * (vals[-1] - li) + lo
+
+
+def strongKernel(vals, settings):
+    value = vals[-1]
+    return value**2 * (-2*value + 3)
+
+
+def weakKernel(vals, settings):
+    value = vals[-1]
+    return 2*value - (value**2 * (-2*value + 3))
+
+
+def andScalar(vals, settings):
+    result = vals[0]
+    for value in vals[1:]:
+        if settings["Method"] == "MUL":
+            result *= value
+        else:
+            result = min(result, value)
+    return result
+
+
+def andArray(cols, settings):
+    result = cols[0]
+    for value in cols[1:]:
+        if settings["Method"] == "MUL":
+            result = result * value
+        else:
+            result = np.minimum(result, value)
+    return result
+
+
+def orScalar(vals, settings):
+    result = 1 - vals[0]
+    for value in vals[1:]:
+        if settings["Method"] == "MUL":
+            result *= (1 - value)
+        else:
+            result = min(1 - result, 1 - value)
+    return 1 - result
+
+
+def orArray(cols, settings):
+    result = 1 - cols[0]
+    for value in cols[1:]:
+        if settings["Method"] == "MUL":
+            result = result * (1 - value)
+        else:
+            result = np.minimum(1 - result, 1 - value)
+    return 1 - result
+
+
+def mathUsable(settings):
+    return not (settings["operation"] == "div" and settings["num1"] == 0)
+
+
+def mapUsable(settings):
+    return settings["LowerInput"] != settings["UpperInput"]
+
+
+def singleUsable(settings):
+    return not settings["SingleOutput"]
+
+
+"""{neuron type: (kernel for one agent, kernel for arrays of agents or None
+to use the first one for arrays too, test of the settings)}"""
+KERNELS = {LogicGRAPH: (graphScalar, graphArray, None),
+           LogicMATH: (mathKernel, None, mathUsable),
+           LogicMAP: (mapKernel, None, mapUsable),
+           LogicSTRONG: (strongKernel, None, None),
+           LogicWEAK: (weakKernel, None, None),
+           LogicAND: (andScalar, andArray, singleUsable),
+           LogicOR: (orScalar, orArray, singleUsable)}
+
+
+def isVector(neuron):
+    """Can the neuron be evaluated for all the agents at the same time"""
+    if type(neuron) not in KERNELS:
+        return False
+    usable = KERNELS[type(neuron)][2]
+    return usable is None or usable(neuron.settings)
+
+
+def makeStages(brain):
+    """Split the plan of a brain into runs of vector and per agent neurons
+
+    :returns: [(True, [neuron name]) | (False, [neuron name])], the names
+              of the neurons whose results the per agent neurons and
+              states use"""
+    stages = []
+    needed = set()
+    for name in brain.program.order:
+        neuron = brain.neurons[name]
+        vector = isVector(neuron)
+        if not vector:
+            if isinstance(neuron, State):
+                needed.update(neuron.valueInputs)
+            else:
+                needed.update(neuron.inputs)
+        if stages and stages[-1][0] == vector:
+            stages[-1][1].append(name)
+        else:
+            stages.append((vector, [name]))
+    return stages, needed
+
+
+def singleValue(result):
+    """The value of a result that is a single number, otherwise None"""
+    if result is None or len(result) != 1 or "None" not in result:
+        return None
+    value = result["None"]
+    if isinstance(value, (int, float)):
+        return value
+    return None
+
+
+def newColumn(count, dtype):
+    if np is not None:
+        return np.zeros(count, dtype=dtype)
+    return [dtype()] * count
+
+
+def nonZero(mask):
+    """The indices of the agents where mask is True"""
+    if np is not None:
+        return np.flatnonzero(mask).tolist()
+    return [i for i, m in enumerate(mask) if m]
+
+
+class VectorEngine:
+    """Evaluates the brains of many agents one node at a time.
+
+    The results of the vector neurons are kept in columns (an array with an
+    element for every agent) and only given to the neurons of each agent
+    when a per agent neuron or state needs them, or the telemetry of the
+    agent is being recorded"""
+    def __init__(self, sim):
+        self.sim = sim
+        self.stages = {}  # {BrainProgram: (stages, needed)} see makeStages
+
+    def think(self, agents):
+        """Evaluate the brains of the agents. Agents.readBrain still needs to
+        be called afterwards"""
+        byProgram = {}
+        for agent in agents:
+            byProgram.setdefault(agent.brain.program, []).append(agent.brain)
+        for program, brains in byProgram.items():
+            if program not in self.stages:
+                self.stages[program] = makeStages(brains[0])
+            stages, needed = self.stages[program]
+            self.runProgram(program, stages, needed, brains)
+
+    def runProgram(self, program, stages, needed, brains):
+        for brain in brains:
+            brain.begin()
+        # {current state: indices of the brains in that state}
+        byState = {}
+        for i, brain in enumerate(brains):
+            byState.setdefault(brain.activeState(), []).append(i)
+        if np is not None:
+            byState = {k: np.array(v) for k, v in byState.items()}
+        self.brains = brains
+        self.program = program
+        self.byState = byState
+        self.columns = {}  # {name: (values, single)} single marks the
+        #                    agents whose result is values[i]
+        self.pending = {}  # {name: mask of the agents whose result is only
+        #                    in the column}
+        for vector, names in stages:
+            if vector:
+                with section("vector", "VectorEngine.vector"):
+                    for name in names:
+                        self.runVector(name)
+            else:
+                with section("vector", "VectorEngine.writeBack"):
+                    self.writeBack(needed)
+                for state, indices in byState.items():
+                    members = program.stateMembers[state]
+                    active = [name for name in names if name in members]
+                    if not active:
+                        continue
+                    for i in indices:
+                        brain = brains[i]
+                        brain.setUser()
+                        for name in active:
+                            neuron = brain.neurons[name]
+                            if isinstance(neuron, State):
+                                neuron.evaluate()
+                            else:
+                                neuron.runGuarded()
+        self.writeBack(needed)
+        self.logPending()
+        self.brains = self.columns = self.pending = None
+        for brain in brains:
+            brain.finish()
+
+    def activeMask(self, name):
+        """Which brains the neuron is run for"""
+        mask = newColumn(len(self.brains), bool)
+        for state, indices in self.byState.items():
+            if name in self.program.stateMembers[state]:
+                if np is not None:
+                    mask[indices] = True
+                else:
+                    for i in indices:
+                        mask[i] = True
+        return mask
+
+    def gather(self, name):
+        """The column of a neuron's results"""
+        if name in self.columns:
+            return self.columns[name]
+        count = len(self.brains)
+        values = newColumn(count, float)
+        single = newColumn(count, bool)
+        for i, brain in enumerate(self.brains):
+            value = singleValue(brain.neurons[name].result)
+            if value is not None:
+                values[i] = value
+                single[i] = True
+        self.columns[name] = (values, single)
+        return values, single
+
+    def materialise(self, name, i):
+        """Give the neuron of agent i its result from the column"""
+        mask = self.pending.get(name)
+        if mask is None or not mask[i]:
+            return
+        mask[i] = False
+        output = SingleImpulse(float(self.columns[name][0][i]))
+        neuron = self.brains[i].neurons[name]
+        neuron.result = output
+        neuron.evaluated = True
+        neuron.logResult(output)
+
+    def writeBack(self, names):
+        """Give the neurons of every agent their results from the columns"""
+        for name in [n for n in self.pending if n in names]:
+            values, single = self.columns[name]
+            if np is not None:
+                values = values.tolist()
+            mask = self.pending.pop(name)
+            for i in nonZero(mask):
+                output = SingleImpulse(values[i])
+                neuron = self.brains[i].neurons[name]
+                neuron.result = output
+                neuron.evaluated = True
+                neuron.logResult(output)
+
+    def logPending(self):
+        """Record the results that stayed in columns for the agents whose
+        telemetry is being recorded"""
+        for i, brain in enumerate(self.brains):
+            if brain.telemetry is not None:
+                for name in list(self.pending):
+                    self.materialise(name, i)
+
+    def runVector(self, name):
+        """Evaluate the same node for every agent"""
+        brains = self.brains
+        count = len(brains)
+        first = brains[0].neurons[name]
+        scalar, array, _ = KERNELS[type(first)]
+        settings = first.settings
+        inputs = [self.gather(i) for i in first.inputs if i in first.neurons]
+        active = self.activeMask(name)
+
+        if np is not None:
+            ok = active.copy()
+            for values, single in inputs:
+                ok &= single
+            if inputs and ok.any():
+                with np.errstate(all="ignore"):
+                    result = (array or scalar)([v for v, s in inputs],
+                                               settings)
+                values = np.array(np.broadcast_to(result, (count,)),
+                                  dtype=float)
+            else:
+                values = np.zeros(count)
+            fallback = np.flatnonzero(active & ~ok).tolist()
+            if not inputs:
+                ok[:] = False
+        else:
+            ok = [False] * count
+            values = [0.0] * count
+            fallback = []
+            for i in range(count):
+                if not active[i]:
+                    continue
+                if inputs and all(s[i] for v, s in inputs):
+                    try:
+                        values[i] = scalar([v[i] for v, s in inputs],
+                                           settings)
+                        ok[i] = True
+                        continue
+                    except ArithmeticError:
+                        pass
+                fallback.append(i)
+
+        pending = ok.copy() if np is not None else list(ok)
+        single = ok
+        for i in fallback:
+            # Inputs that aren't single values, or errors that should be
+            # raised in the same way as the per agent engine
+            for inp in first.inputs:
+                self.materialise(inp, i)
+            neuron = brains[i].neurons[name]
+            neuron.run()
+            value = singleValue(neuron.result)
+            if value is not None:
+                values[i] = value
+                single[i] = True
+        self.columns[name] = (values, single)
+        self.pending[name] = pending
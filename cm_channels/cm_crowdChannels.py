@@ -22,6 +22,7 @@ import mathutils
 import math
 from .cm_masterChannels import MasterChannel as Mc
 from mathutils import Vector
+from ..cm_profiler import profiled
 
 
 class Crowd(Mc):
@@ -49,6 +50,7 @@ class Crowd(Mc):
             s *= hash(item) % (10**25) + 1
         return s
 
+    @profiled("Crowd.calcSeparate")
     def calcSeparate(self, localArea):
         sepVec = Vector([0, 0, 0])
         if len(localArea) == 0:
@@ -67,6 +69,7 @@ class Crowd(Mc):
         relative = sepVec * rotation
         return relative
 
+    @profiled("Crowd.calcAlign")
     def calcAlign(self, localArea):
         alnVec = Vector([0, 0, 0])
         if len(localArea) == 0:
@@ -100,6 +103,7 @@ class Crowd(Mc):
             alnVec.z = -2 + alnVec.z/math.pi
         return alnVec
 
+    @profiled("Crowd.calcCohere")
     def calcCohere(self, localArea):
         cohVec = Vector([0, 0, 0])
         if len(localArea) == 0:
@@ -22,6 +22,7 @@ import mathutils
 import math
 
 from ..libs.ins_clustering import clusterMatch
+from ..cm_profiler import profiled
 
 import bpy
 
@@ -41,6 +42,30 @@ class Formation(Mc):
             chan.newuser(userid)
         Mc.setuser(self, userid)
 
+    def getState(self):
+        return {formID: ch.getState() for formID, ch in self.formations.items()}
+
+    def setState(self, state):
+        """Must be called after newframe as that would change the priority"""
+        for formID, chState in state.items():
+            if formID not in self.formations:
+                self.retrieve(formID).findTargets()
+            self.formations[formID].setState(chState)
+
+    def workerState(self):
+        return {formID: ch.inpBuffer for formID, ch in self.formations.items()}
+
+    def mergeWorkerState(self, state):
+        """Add the agents that used each formation in a worker process in the
+        same order they would have been added if run in one process"""
+        for formID, inpBuffer in state.items():
+            if formID not in self.formations:
+                self.retrieve(formID)
+            ch = self.formations[formID]
+            for userid in inpBuffer:
+                if userid not in ch.inpBuffer:
+                    ch.inpBuffer.append(userid)
+
     def registerOld(self, agent, formID, val):
         """Adds an object that is a formation target"""
         if formID in dir(self):
@@ -77,6 +102,24 @@ class Channel:
 
         self.userid = ""  # see "newuser" method
 
+    def getState(self):
+        """The values that are kept from one frame to the next"""
+        lastCalcd = None
+        if self.lastCalcd:
+            agents, targets, calcd = self.lastCalcd
+            lastCalcd = (agents, targets,
+                         {k: tuple(v) for k, v in calcd.items()})
+        return {"priority": list(self.priority), "lastCalcd": lastCalcd}
+
+    def setState(self, state):
+        self.priority = list(state["priority"])
+        self.lastCalcd = None
+        if state["lastCalcd"]:
+            agents, targets, calcd = state["lastCalcd"]
+            self.lastCalcd = (set(agents), set(targets),
+                              {k: mathutils.Vector(v)
+                               for k, v in calcd.items()})
+
     def register(self, objs):
         """Add a formation target object"""
         self.targetObjects = objs
@@ -99,12 +142,16 @@ class Channel:
                 new.append(i)
         self.priority = new
         self.inpBuffer = []
+        self.findTargets()
 
+    def findTargets(self):
+        """The world positions of the vertices of the target objects"""
         self.targets = []
         for ob in self.targetObjects:
             wrld = ob.matrix_world
             self.targets += [wrld*v.co for v in ob.data.vertices]
 
+    @profiled("Formation.Channel.calculate")
     def calculate(self):
         """Collect data and use clusterMatch to work out pairings"""
         objs = bpy.data.objects
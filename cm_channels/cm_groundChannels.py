@@ -23,6 +23,7 @@ from mathutils import *
 BVHTree = bvhtree.BVHTree
 
 from .cm_masterChannels import MasterChannel as Mc
+from ..cm_profiler import profiled
 
 
 class Ground(Mc):
@@ -70,6 +71,7 @@ class Channel:
         self.calcd = False
         self.groundTrees = {}
 
+    @profiled("Ground.Channel.calcground")
     def calcground(self):
         """Called the first time each agent uses the Ground channel"""
         results = []
@@ -39,3 +39,24 @@ class MasterChannel:
     def setuser(self, userid):
         """Set up the channel to be used with a new agent"""
         self.userid = userid
+
+    def getState(self):
+        """Override this in child classes that keep data between frames.
+        The return value is saved in checkpoints"""
+        return None
+
+    def setState(self, state):
+        """Override this in child classes to restore the value returned by
+        getState"""
+        pass
+
+    def workerState(self):
+        """Override this in child classes that keep data between frames that
+        is changed while the brains are evaluated. The return value is sent
+        from the worker processes back to the main process"""
+        return None
+
+    def mergeWorkerState(self, state):
+        """Override this in child classes to combine the values returned by
+        workerState in the main process"""
+        pass
@@ -18,7 +18,9 @@
 # ##### END GPL LICENSE BLOCK #####
 
 from .cm_masterChannels import MasterChannel as Mc
-import random
+from ..cm_random import counterRandom, randomKey
+
+AGENTRANDOM = randomKey("agentRandom")
 
 
 class Noise(Mc):
@@ -26,17 +28,14 @@ class Noise(Mc):
     def __init__(self, sim):
         Mc.__init__(self, sim)
 
-    def random(self):
-        """Returns a random number in range 0-1"""
-        return random.random()
+    def random(self, key=0):
+        """Returns a random number in range 0-1
+
+        :param key: the randomKey of the node asking (see cm_random)"""
+        return self.sim.agents[self.userid].brain.random(key)
 
     def agentRandom(self, offset=0):
         """Return a random number that is consistent between frame but can
         be offset by an integer"""
-        state = random.getstate()
-        random.seed(hash(self.userid) - 1 + offset)
-        # -1 so that this number is different to the first random number
-        # generated on frame 0 (if used) of the simulation
-        result = random.random()
-        random.setstate(state)
-        return result
+        slot = self.sim.agents[self.userid].slot
+        return counterRandom(self.sim.randomSeed, slot, AGENTRANDOM, offset)
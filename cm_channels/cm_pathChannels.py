@@ -30,6 +30,7 @@ from bpy.props import FloatProperty
 from bpy.types import PropertyGroup, UIList, Panel, Operator
 
 from .cm_masterChannels import MasterChannel as Mc
+from ..cm_profiler import profiled
 
 
 class Path(Mc):
@@ -47,6 +48,7 @@ class Path(Mc):
         Mc.setuser(self, userid)
         self.resultsCache = {}
 
+    @profiled("Path.calcPathData")
     def calcPathData(self, pathObject):
         if pathObject in self.pathObjectCache:
             return self.pathObjectCache[pathObject]
@@ -152,6 +154,7 @@ class Path(Mc):
             index = nextIndex
             nextIndex = nextVert.index
 
+    @profiled("Path.calcRelativeTarget")
     def calcRelativeTarget(self, pathObject, radius, lookahead):
         context = bpy.context
 
@@ -23,6 +23,7 @@ import mathutils
 Vector = mathutils.Vector
 
 from ..libs import ins_octree as ot
+from ..cm_profiler import profiled
 
 import bpy
 
@@ -89,6 +90,7 @@ class Channel:
         self.storePrediction = {}
         self.storeSteering = {}
 
+    @profiled("Sound.Channel.calculate")
     def calculate(self):
         """Called the first time an agent uses this frequency"""
         O = bpy.context.scene.objects
@@ -185,6 +187,7 @@ class Channel:
                 self.store[emitterid] = (changez, changex, 1-(dist/val), 1)
                 # (z rot, x rot, dist proportion, time until prediction)"""
 
+    @profiled("Sound.Channel.calculatePrediction")
     def calculatePrediction(self):
         """Called the first time an agent uses this frequency"""
         ag = O[self.userid]
@@ -249,6 +252,7 @@ class Channel:
                                                        "cert": cert}
                     # (z rot, x rot, dist proportion, time until prediction)
 
+    @profiled("Sound.Channel.calculateSteering")
     def calculateSteering(self):
         """Called the first time an agent uses this frequency"""
         MAXLOOKAHEAD = 64
@@ -19,6 +19,7 @@
 
 import bpy
 from .cm_masterChannels import MasterChannel as Mc
+from ..cm_profiler import profiled
 
 import math
 import mathutils
@@ -58,6 +59,7 @@ class Channel:
         self.store = {}
         self.calcd = False
 
+    @profiled("World.Channel.calculate")
     def calculate(self):
         O = bpy.context.scene.objects
 
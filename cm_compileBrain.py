@@ -18,8 +18,37 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import bpy
+from functools import partial
 from .cm_nodeFunctions import logictypes, statetypes
-from .cm_brainClasses import Brain
+from .cm_nodeFunctions import (LogicCONSTANT, LogicNEWINPUT, LogicGRAPH,
+                               LogicMATH, LogicMAP, LogicSTRONG, LogicWEAK,
+                               LogicAND, LogicOR, LogicFILTER, LogicPRIORITY,
+                               LogicOUTPUT, LogicSETTAG, LogicVARIABLE,
+                               LogicPRINT, LogicPYTHON, LogicINPUT)
+from .cm_brainClasses import Brain, State
+from .cm_impulse import toImpulse
+from .cm_pythonEmbededInterpreter import UserCode
+from .cm_random import randomKey
+from .cm_brainCodegen import compileSource
+
+
+FOLDABLE = (LogicGRAPH, LogicMATH, LogicMAP, LogicSTRONG, LogicWEAK, LogicAND,
+            LogicOR, LogicFILTER, LogicPRIORITY)
+"""Nodes whose output only depends on their inputs and settings"""
+
+EFFECTS = (LogicOUTPUT, LogicSETTAG, LogicVARIABLE, LogicPRINT, LogicPYTHON,
+           LogicINPUT)
+"""Nodes that change something other than their own result. Any other node
+is only kept if one of these (or a state) uses it"""
+
+USERCODE = {LogicINPUT: ("Input", "eval"),
+            LogicPYTHON: ("Expression", "exec")}
+"""{neuron type: (setting holding the code, mode to compile it in)}"""
+
+
+def isActive(spec, state):
+    """Does the neuron run while state is the current state"""
+    return spec.isState or not spec.dependantOn or state in spec.dependantOn
 
 
 def getInputs(inp):
@@ -56,17 +85,229 @@ def getOutputs(out):
     return result
 
 
-def compileBrain(nodeGroup, sim, userid):
-    """Compile the brain that defines how and agent moves and is animated"""
-    result = Brain(sim, userid)
+STATEATTRIBUTES = ("length", "cycleState", "actionName", "useValueOfSpeed")
+"""Set on the spec by the getSettings of some state nodes and copied onto
+the State by BrainProgram.instantiate"""
+
+
+class NeuronSpec:
+    """How to create one neuron. Shared by all the agents with the brain"""
+    __slots__ = ("name", "neuronType", "bpyNode", "isState", "settings",
+                 "inputs", "dependantOn", "outputs",
+                 "valueInputs") + STATEATTRIBUTES
+
+    def __init__(self, name, neuronType, bpyNode, isState=False):
+        self.name = name
+        self.isState = isState
+        self.neuronType = neuronType
+        self.bpyNode = bpyNode
+        self.settings = {}  # Filled by node.getSettings. Not changed after
+        self.inputs = []
+        self.dependantOn = []
+        self.outputs = []
+        self.valueInputs = []
+
+
+class BrainProgram:
+    """The result of compiling a brain node group. Everything in here is the
+    same for every agent that uses the node group so it is only worked out
+    once and never changed. instantiate creates the per agent part"""
+    def __init__(self, name):
+        self.name = name
+        self.nodes = []  # type: List[NeuronSpec]
+        self.outputs = []  # type: List[str] - in the order they're evaluated
+        self.order = []  # type: List[str] - every neuron the outputs need
+        self.statePlans = {}  # type: Dict[str | None, List[str]] - see Brain.plans
+        self.stateMembers = {}  # type: Dict[str | None, FrozenSet[str]]
+        self.startState = None
+        self.folded = []  # type: List[str] - replaced with LogicCONSTANT
+        self.removed = []  # type: List[str] - removed as nothing uses them
+        self.sources = None  # Generated by cm_brainCodegen when first needed
+        self.generated = None  # {state: function}
+
+    def instantiate(self, sim, userid, codegen=False):
+        """Create the brain of one agent
+
+        :param codegen: run the brain with the functions generated by
+                        cm_brainCodegen instead of the neurons run methods"""
+        result = Brain(sim, userid)
+        result.program = self
+        for spec in self.nodes:
+            if spec.isState:
+                item = spec.neuronType(result, spec.bpyNode, spec.name)
+                item.outputs = spec.outputs
+                item.valueInputs = spec.valueInputs
+                for attr in STATEATTRIBUTES:
+                    if hasattr(spec, attr):
+                        setattr(item, attr, getattr(spec, attr))
+            else:
+                item = spec.neuronType(result, spec.bpyNode)
+                item.randomKey = randomKey(spec.name)
+                item.inputs = spec.inputs
+                item.dependantOn = spec.dependantOn
+            item.settings = spec.settings
+            result.neurons[spec.name] = item
+        result.outputs = self.outputs
+        for spec in self.nodes:
+            if not spec.isState:
+                result.neurons[spec.name].link()
+        if codegen:
+            if self.generated is None:
+                self.sources, self.generated = compileSource(self)
+            neurons = tuple(result.neurons[spec.name] for spec in self.nodes)
+            for state, func in self.generated.items():
+                result.plans[state] = [partial(func, result, neurons)]
+        else:
+            for state, names in self.statePlans.items():
+                plan = []
+                for name in names:
+                    neuron = result.neurons[name]
+                    if isinstance(neuron, State):
+                        plan.append(neuron.evaluate)
+                    else:
+                        plan.append(neuron.run)
+                result.plans[state] = plan
+        if self.startState is not None:
+            result.setStartState(self.startState)
+        return result
+
+    def sortNodes(self):
+        """Work out the order that the neurons are run in. The same order that
+        evaluating the outputs one at a time recursively would give"""
+        specs = {spec.name: spec for spec in self.nodes}
+        visited = set()
+        order = []
+
+        def visit(name):
+            if name in visited or name not in specs:
+                return
+            visited.add(name)
+            spec = specs[name]
+            for inp in spec.valueInputs if spec.isState else spec.inputs:
+                visit(inp)
+            order.append(name)
+
+        for out in self.outputs:
+            visit(out)
+        self.order = order
+
+    def planStates(self):
+        """Work out which neurons are run while each state is current. A
+        neuron that is dependant on states only produces an output while
+        one of them is current so it is left out of the other plans, along
+        with its inputs unless something else that runs uses them (in the
+        same way that evaluating the outputs recursively wouldn't reach them)"""
+        specs = {spec.name: spec for spec in self.nodes}
+        states = [None] + [spec.name for spec in self.nodes if spec.isState]
+        self.statePlans = {}
+        self.stateMembers = {}
+        for state in states:
+            visited = set()
+            plan = []
+
+            def visit(name):
+                if name in visited or name not in specs:
+                    return
+                visited.add(name)
+                spec = specs[name]
+                if not isActive(spec, state):
+                    return
+                for inp in spec.valueInputs if spec.isState else spec.inputs:
+                    visit(inp)
+                plan.append(name)
+
+            for out in self.outputs:
+                visit(out)
+            self.statePlans[state] = plan
+            self.stateMembers[state] = frozenset(plan)
+
+    def foldConstants(self):
+        """Replace constant inputs, and nodes that only have constant inputs,
+        with LogicCONSTANT neurons holding the value worked out now"""
+        specs = {spec.name: spec for spec in self.nodes}
+        constants = {}  # {name: value}
+        for name in self.order:
+            spec = specs[name]
+            if spec.isState or spec.dependantOn:
+                continue
+            if spec.neuronType is LogicNEWINPUT:
+                if spec.settings["InputSource"] != "CONSTANT":
+                    continue
+                value = toImpulse(spec.settings["Constant"])
+            elif spec.neuronType in FOLDABLE:
+                if not spec.inputs or not all(i in constants for i in spec.inputs):
+                    continue
+                inps = [constants[i] for i in spec.inputs
+                        if constants[i] is not None]
+                neuron = spec.neuronType.__new__(spec.neuronType)
+                neuron.settings = spec.settings
+                try:
+                    value = neuron.core(inps, spec.settings)
+                except Exception:
+                    # Left to run (or fail in the same way) with the brain.
+                    # The neuron isn't fully set up so a core that uses more
+                    # than its settings can't be folded either
+                    continue
+                value = toImpulse(value)
+            else:
+                continue
+            constants[name] = value
+            self.folded.append(name)
+            spec.neuronType = LogicCONSTANT
+            spec.settings = {"Value": value}
+            spec.inputs = []
+
+    def pruneNodes(self):
+        """Remove the neurons that can't affect an effect node or a state"""
+        specs = {spec.name: spec for spec in self.nodes}
+        live = set()
+
+        def mark(name):
+            if name in live or name not in specs:
+                return
+            live.add(name)
+            spec = specs[name]
+            for inp in spec.valueInputs if spec.isState else spec.inputs:
+                mark(inp)
+
+        for name in self.order:
+            spec = specs[name]
+            if spec.isState or spec.neuronType in EFFECTS:
+                mark(name)
+        self.removed = [spec.name for spec in self.nodes
+                        if not spec.isState and spec.name not in live]
+        self.nodes = [spec for spec in self.nodes
+                      if spec.isState or spec.name in live]
+        self.outputs = [name for name in self.outputs if name in live]
+        self.order = [name for name in self.order if name in live]
+
+    def optimise(self):
+        """Fold the constants and then remove whatever isn't used"""
+        self.foldConstants()
+        self.pruneNodes()
+
+    def report(self):
+        """What optimise changed"""
+        return ("Brain {}: folded {} constant node(s) {}, removed {} unused "
+                "node(s) {}".format(self.name, len(self.folded), self.folded,
+                                    len(self.removed), self.removed))
+
+
+def compileProgram(nodeGroup):
+    """Walk the node tree of a brain. Done once per node group"""
     preferences = bpy.context.user_preferences.addons[__package__].preferences
+    result = BrainProgram(nodeGroup.name)
     """create the connections from the node"""
     for node in nodeGroup.nodes:
         if node.bl_idname in logictypes:
             # node.name  -  The identifier
             # node.bl_idname  -  The type
-            item = logictypes[node.bl_idname](result, node)
+            item = NeuronSpec(node.name, logictypes[node.bl_idname], node)
             node.getSettings(item)
+            if item.neuronType in USERCODE:
+                setting, mode = USERCODE[item.neuronType]
+                item.settings["Code"] = UserCode(item.settings[setting], mode,
+                                                 node.name)
             if node.bl_idname == "PriorityNode":
                 item.inputs = getMultiInputs(node.inputs)
             else:
@@ -74,18 +315,35 @@ def compileBrain(nodeGroup, sim, userid):
             item.dependantOn = getOutputs(node.outputs["Dependant"])
             if not node.outputs["Output"].is_linked:
                 result.outputs.append(node.name)
-            result.neurons[node.name] = item
+            result.nodes.append(item)
         elif node.bl_idname in statetypes:
-            item = statetypes[node.bl_idname](result, node, node.name)
+            item = NeuronSpec(node.name, statetypes[node.bl_idname], node,
+                              True)
             node.getSettings(item)
             item.outputs = getOutputs(node.outputs["To"])
             if preferences.show_debug_options:
                 print(node.name, "outputs", item.outputs)
             if node.bl_idname == "StartState":
-                result.setStartState(node.name)
+                result.startState = node.name
             else:
                 item.valueInputs = getInputs(node.inputs["Value"])
                 if len(item.valueInputs) != 0:
                     result.outputs.append(node.name)
-            result.neurons[node.name] = item
+            result.nodes.append(item)
+    result.sortNodes()
+    if preferences.optimise_brains:
+        result.optimise()
+        if preferences.show_debug_options:
+            print(result.report())
+    result.planStates()
     return result
+
+
+def compileBrain(nodeGroup, sim, userid):
+    """Compile the brain that defines how and agent moves and is animated.
+    The node group is only compiled the first time it is used in sim"""
+    preferences = bpy.context.user_preferences.addons[__package__].preferences
+    if nodeGroup.name not in sim.compbrains:
+        sim.compbrains[nodeGroup.name] = compileProgram(nodeGroup)
+    codegen = preferences.brain_engine == "CODEGEN"
+    return sim.compbrains[nodeGroup.name].instantiate(sim, userid, codegen)
@@ -0,0 +1,167 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""The values passed between the neurons of a brain.
+
+Both types are read only mappings of {str: float} so the nodes can use them
+in the same way as dicts. The keys are interned to ints (see keyId) and the
+values are kept in an array so that the nodes that change every value don't
+have to hash the keys again"""
+
+from array import array
+from collections.abc import Mapping
+
+_keyIds = {"None": 0}  # type: Dict[str, int]
+_keyNames = ["None"]  # type: List[str]
+
+
+def keyId(key):
+    """The int that key is interned to"""
+    i = _keyIds.get(key)
+    if i is None:
+        i = len(_keyNames)
+        _keyIds[key] = i
+        _keyNames.append(key)
+    return i
+
+
+class ImpulseContainer(Mapping):
+    """Any number of values keyed by (normally) the names of agents"""
+    __slots__ = ("ids", "vals", "_positions")
+
+    def __init__(self, ids, vals):
+        """:param ids: array('i') of interned keys (not to be changed after)
+        :param vals: array('d') of the values in the same order"""
+        self.ids = ids
+        self.vals = vals
+        self._positions = None  # {key: index}, made by the first lookup
+
+    def positions(self):
+        """{key: index in vals}"""
+        if self._positions is None:
+            self._positions = {_keyNames[k]: n for n, k in enumerate(self.ids)}
+        return self._positions
+
+    @classmethod
+    def fromDict(cls, values):
+        """:raises TypeError: if any of the values aren't numbers"""
+        vals = array('d', values.values())
+        return cls(array('i', map(keyId, values)), vals)
+
+    def __getitem__(self, key):
+        return self.vals[self.positions()[key]]
+
+    def get(self, key, default=None):
+        n = self.positions().get(key)
+        if n is None:
+            return default
+        return self.vals[n]
+
+    def __contains__(self, key):
+        return key in self.positions()
+
+    def __iter__(self):
+        return map(_keyNames.__getitem__, self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def items(self):
+        return zip(map(_keyNames.__getitem__, self.ids), self.vals)
+
+    def values(self):
+        return self.vals
+
+    def map(self, func):
+        """A container with func applied to every value"""
+        result = ImpulseContainer(self.ids, array('d', map(func, self.vals)))
+        result._positions = self._positions  # The keys are the same
+        return result
+
+    def __repr__(self):
+        return "ImpulseContainer({!r})".format(dict(self.items()))
+
+
+class SingleImpulse(Mapping):
+    """One value with the key "None". What most neurons output"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __getitem__(self, key):
+        if key == "None":
+            return self.value
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key == "None"
+
+    def __iter__(self):
+        yield "None"
+
+    def __len__(self):
+        return 1
+
+    def items(self):
+        return (("None", self.value),)
+
+    def values(self):
+        return (self.value,)
+
+    def map(self, func):
+        return SingleImpulse(func(self.value))
+
+    def __repr__(self):
+        return "SingleImpulse({!r})".format(self.value)
+
+
+IMPULSES = (ImpulseContainer, SingleImpulse)
+
+
+def toImpulse(output):
+    """Convert the result of Neuron.core. Numbers and dicts of numbers
+    become impulses, anything else is left as {"None": output} or the dict"""
+    if output is None or isinstance(output, IMPULSES):
+        return output
+    if isinstance(output, dict):
+        if len(output) == 1 and "None" in output:
+            value = output["None"]
+            if isinstance(value, (int, float)):
+                return SingleImpulse(value)
+            return output
+        try:
+            return ImpulseContainer.fromDict(output)
+        except TypeError:
+            return output
+    if isinstance(output, (int, float)):
+        return SingleImpulse(output)
+    return {"None": output}
+
+
+def mapImpulses(inps, func):
+    """Apply func to every value of the inputs. When more than one input has
+    the same key the value from the last one is used"""
+    if len(inps) == 1 and isinstance(inps[0], IMPULSES):
+        return inps[0].map(func)
+    result = {}
+    for into in inps:
+        for i, v in into.items():
+            result[i] = func(v)
+    return toImpulse(result)
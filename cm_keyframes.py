@@ -0,0 +1,253 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import bpy
+from array import array
+from bpy.props import FloatProperty, BoolProperty
+from bpy.types import Operator
+
+from .cm_profiler import profiled
+
+"""(store column, last keyed value column, key flag column, data path, index)
+for every animated channel of an agent"""
+CHANNELS = (("arx", "arxKeyed", "arxKey", "rotation_euler", 0),
+            ("ary", "aryKeyed", "aryKey", "rotation_euler", 1),
+            ("arz", "arzKeyed", "arzKey", "rotation_euler", 2),
+            ("apx", "apxKeyed", "apxKey", "location", 0),
+            ("apy", "apyKeyed", "apyKey", "location", 1),
+            ("apz", "apzKeyed", "apzKey", "location", 2))
+
+
+class KeyframeWriter:
+    """Collects the keyframes of every agent during the simulation and adds
+    them to the fcurves in bulk. Inserting the keyframes one at a time with
+    keyframe_insert is the slowest part of the simulation for large crowds"""
+    def __init__(self, store):
+        self.store = store
+        self.buffers = {}
+        """{(slot, channel): array('f') of frame, value pairs in the order
+        they were keyed}"""
+
+    def key(self, slot, frame):
+        """Record the keyframes for an agent that has been moved to frame.
+        A channel is only keyed when it changes. When a channel starts
+        changing again the previous frame is keyed as well so that the value
+        holds until then"""
+        store = self.store
+        buffers = self.buffers
+        for channel, (col, keyedCol, flagCol, _, _) in enumerate(CHANNELS):
+            value = getattr(store, col)[slot]
+            keyed = getattr(store, keyedCol)
+            flags = getattr(store, flagCol)
+            if abs(value - keyed[slot]) > 0.000001:
+                buf = buffers.get((slot, channel))
+                if buf is None:
+                    buf = array('f')
+                    buffers[(slot, channel)] = buf
+                if not flags[slot]:
+                    buf.append(frame - 1)
+                    buf.append(keyed[slot])
+                    flags[slot] = 1
+                buf.append(frame)
+                buf.append(value)
+                keyed[slot] = value
+            else:
+                flags[slot] = 0
+
+    def discardAfter(self, frame):
+        """Forget the keyframes that haven't been written yet after frame"""
+        for key, buf in list(self.buffers.items()):
+            kept = array('f')
+            for i in range(0, len(buf), 2):
+                if buf[i] <= frame:
+                    kept.append(buf[i])
+                    kept.append(buf[i + 1])
+            if kept:
+                self.buffers[key] = kept
+            else:
+                del self.buffers[key]
+
+    @profiled("KeyframeWriter.flush", "keyframes")
+    def flush(self):
+        """Write all of the collected keyframes to the agents fcurves"""
+        objs = bpy.data.objects
+        names = self.store.names
+        for (slot, channel), buf in self.buffers.items():
+            _, _, _, dataPath, index = CHANNELS[channel]
+            fc = findFCurve(objs[names[slot]], dataPath, index)
+            writeKeyframes(fc, buf)
+        self.buffers = {}
+
+
+def findFCurve(obj, dataPath, index):
+    """The fcurve for a channel of an object, created if it doesn't exist"""
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    action = obj.animation_data.action
+    if action is None:
+        action = bpy.data.actions.new(obj.name + "Action")
+        obj.animation_data.action = action
+    fc = action.fcurves.find(dataPath, index)
+    if fc is None:
+        fc = action.fcurves.new(dataPath, index, "Object Transforms")
+    return fc
+
+
+def writeKeyframes(fc, buf):
+    """Add the frame, value pairs in buf to an fcurve. Any existing keyframe
+    on the same frame is replaced"""
+    points = fc.keyframe_points
+    count = len(points)
+    existing = array('f', [0.0]) * (count * 2)
+    points.foreach_get("co", existing)
+    if count == 0 or existing[-2] < buf[0]:
+        # Setting every keyframe in one call is much faster than setting
+        # only the new ones one at a time
+        existing.extend(buf)
+        points.add(len(buf) // 2)
+        points.foreach_set("co", existing)
+    else:
+        merged = {}
+        for i in range(0, len(existing), 2):
+            merged[existing[i]] = existing[i + 1]
+        for i in range(0, len(buf), 2):
+            merged[buf[i]] = buf[i + 1]
+        co = array('f')
+        for frame in sorted(merged):
+            co.append(frame)
+            co.append(merged[frame])
+        points.add(len(merged) - count)
+        points.foreach_set("co", co)
+    fc.update()
+
+
+def reduceKeyframes(co, tolerance):
+    """Ramer-Douglas-Peucker reduction of a curve. A keyframe is dropped when
+    the value interpolated linearly between the keyframes that are kept
+    is within tolerance of it
+
+    :param co: frame, value pairs sorted by frame
+    :param tolerance: largest allowed difference in value
+    :returns: the indices (into the list of keyframes) of the ones to keep
+    :rtype: list of int"""
+    count = len(co) // 2
+    if count < 3:
+        return list(range(count))
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        x0, y0 = co[first * 2], co[first * 2 + 1]
+        x1, y1 = co[last * 2], co[last * 2 + 1]
+        slope = (y1 - y0) / (x1 - x0) if x1 != x0 else 0
+        worst = -1
+        worstError = tolerance
+        for i in range(first + 1, last):
+            error = abs(co[i * 2 + 1] - (y0 + slope * (co[i * 2] - x0)))
+            if error > worstError:
+                worst = i
+                worstError = error
+        if worst != -1:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [i for i in range(count) if keep[i]]
+
+
+def reduceFCurve(fc, tolerance):
+    """Remove the keyframes of an fcurve that aren't needed to stay within
+    tolerance. The keyframes that are left are interpolated linearly so that
+    the error between them is bounded
+
+    :returns: the number of keyframes removed"""
+    points = fc.keyframe_points
+    count = len(points)
+    co = array('f', [0.0]) * (count * 2)
+    points.foreach_get("co", co)
+    kept = reduceKeyframes(co, tolerance)
+    if len(kept) == count:
+        return 0
+    # Removing the keyframes one at a time is very slow so they are
+    # removed from the end and the remaining ones are overwritten
+    reduced = array('f')
+    for i in kept:
+        reduced.append(co[i * 2])
+        reduced.append(co[i * 2 + 1])
+    for i in range(count - 1, len(kept) - 1, -1):
+        points.remove(points[i], fast=True)
+    points.foreach_set("co", reduced)
+    for k in points:
+        k.interpolation = 'LINEAR'
+    fc.update()
+    return count - len(kept)
+
+
+class SCENE_OT_cm_reduce_keyframes(Operator):
+    """Remove the keyframes of the agents that can be interpolated from the
+    keyframes either side of them"""
+    bl_idname = "scene.cm_reduce_keyframes"
+    bl_label = "Reduce Keyframes"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    locationTolerance = FloatProperty(name="Location Tolerance",
+                                      description="Largest allowed change in location",
+                                      default=0.001, min=0.0, precision=4)
+    rotationTolerance = FloatProperty(name="Rotation Tolerance",
+                                      description="Largest allowed change in rotation",
+                                      default=0.0017, min=0.0, precision=4,
+                                      subtype='ANGLE')
+    onlySelected = BoolProperty(name="Only Selected",
+                                description="Only reduce the selected agents",
+                                default=False)
+
+    def execute(self, context):
+        scene = context.scene
+        objs = bpy.data.objects
+        names = set()
+        for group in scene.cm_groups:
+            for ty in group.agentTypes:
+                for ag in ty.agents:
+                    names.add(ag.name)
+        if self.onlySelected:
+            names = {n for n in names if n in objs and objs[n].select}
+
+        removed = 0
+        for name in names:
+            if name not in objs:
+                continue
+            anim = objs[name].animation_data
+            if anim is None or anim.action is None:
+                continue
+            for fc in anim.action.fcurves:
+                if fc.data_path == "location":
+                    removed += reduceFCurve(fc, self.locationTolerance)
+                elif fc.data_path == "rotation_euler":
+                    removed += reduceFCurve(fc, self.rotationTolerance)
+
+        self.report({'INFO'}, "Removed {} keyframes".format(removed))
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(SCENE_OT_cm_reduce_keyframes)
+
+
+def unregister():
+    bpy.utils.unregister_class(SCENE_OT_cm_reduce_keyframes)
@@ -0,0 +1,77 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import mathutils
+from bpy_extras.object_utils import world_to_camera_view
+
+
+class LODScheduler:
+    """Decides how often the brain of each agent is evaluated. Agents close
+    to the active camera are evaluated every frame, agents further away or
+    outside of the camera's view less often.
+
+    On the frames an agent is skipped it keeps moving at the same velocity,
+    its tags stay the same and its current state carries on (see
+    Brain.skip). A state can only end on a frame the brain is evaluated so
+    the next state may start up to one interval after the action ended"""
+    def __init__(self, store, near, far, maxInterval, margin=0.1):
+        """
+        :param near: agents closer than this are evaluated every frame
+        :param far: agents further than this are evaluated every maxInterval
+        :param margin: how far outside of the frame (as a proportion of its
+                       size) an agent is still treated as visible"""
+        self.store = store
+        self.near = near
+        self.far = max(far, near)
+        self.maxInterval = max(int(maxInterval), 1)
+        self.margin = margin
+
+    def interval(self, distance, visible):
+        """How many frames there should be between evaluations"""
+        if not visible or distance >= self.far:
+            return self.maxInterval
+        if distance <= self.near:
+            return 1
+        prop = (distance - self.near) / (self.far - self.near)
+        return 1 + int(prop * (self.maxInterval - 1))
+
+    def update(self, scene):
+        """Work out the interval for every agent from the camera as it is on
+        the current frame. Stored in the lodInterval column of the store"""
+        store = self.store
+        intervals = store.lodInterval
+        cam = scene.camera
+        if cam is None:
+            for slot in store.slots.values():
+                intervals[slot] = 1
+            return
+        camLoc = cam.matrix_world.to_translation()
+        low = -self.margin
+        high = 1 + self.margin
+        apx, apy, apz = store.apx, store.apy, store.apz
+        for slot in store.slots.values():
+            pos = mathutils.Vector((apx[slot], apy[slot], apz[slot]))
+            co = world_to_camera_view(scene, cam, pos)
+            visible = co.z > 0 and low <= co.x <= high and low <= co.y <= high
+            intervals[slot] = self.interval((pos - camLoc).length, visible)
+
+    def due(self, slot, frame):
+        """Should the agent in slot be evaluated on frame. The slot is used as
+        an offset so that distant agents don't all think on the same frame"""
+        return (frame + slot) % self.store.lodInterval[slot] == 0
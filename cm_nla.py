@@ -0,0 +1,145 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import bpy
+from bpy.props import BoolProperty
+from bpy.types import Operator
+
+TRACKNAME = "CrowdMaster"
+"""Only the NLA tracks with names starting with this are reused"""
+
+STRIPPROPERTIES = ("action_frame_start", "action_frame_end", "scale",
+                   "repeat", "extrapolation", "blend_type", "blend_in",
+                   "blend_out", "use_auto_blend", "influence",
+                   "use_animated_influence", "mute", "use_reverse")
+"""Copied when a strip is moved to a different track"""
+
+
+def isPoolTrack(track):
+    return track.name.startswith(TRACKNAME)
+
+
+def placeStrip(obj, action, frame):
+    """Start playing action on obj at frame. The strip is put on the lowest
+    CrowdMaster track that is free from frame onwards and above every
+    CrowdMaster track that is still playing, so the new action takes
+    precedence over the older ones like it would on a new track. Each agent
+    only needs as many tracks as it has actions playing at the same time
+
+    :returns: the new strip"""
+    anim = obj.animation_data
+    if anim is None:
+        anim = obj.animation_data_create()
+    track = None
+    for t in anim.nla_tracks:  # From the bottom up
+        if isPoolTrack(t) and not t.is_solo:
+            strips = t.strips
+            if len(strips) == 0 or strips[-1].frame_end < frame:
+                if track is None:
+                    track = t
+            else:
+                track = None  # Only the tracks above this can be used
+    if track is None:
+        track = anim.nla_tracks.new()
+        track.name = TRACKNAME
+    strip = track.strips.new(action.name, frame, action)
+    strip.extrapolation = 'NOTHING'
+    strip.use_auto_blend = True
+    return strip
+
+
+def consolidateTracks(obj):
+    """Repack the strips on an objects CrowdMaster tracks into as few
+    tracks as possible. Needed for animation from before the tracks were
+    pooled or when strips have been moved by hand
+
+    :returns: the number of tracks removed"""
+    anim = obj.animation_data
+    if anim is None:
+        return 0
+    tracks = [t for t in anim.nla_tracks if isPoolTrack(t) or
+              (t.name.startswith("NlaTrack") and len(t.strips) <= 1)]
+    strips = []
+    for track in tracks:
+        for strip in track.strips:
+            if strip.action is not None:
+                settings = {p: getattr(strip, p) for p in STRIPPROPERTIES}
+                strips.append((strip.frame_start, strip.frame_end,
+                               strip.name, strip.action, settings))
+    strips.sort(key=lambda s: s[0])
+
+    packed = []  # [[end of last strip, [strips]]] from the bottom up
+    for strip in strips:
+        # Above every lane that is still playing (see placeStrip)
+        lowest = 0
+        for n, lane in enumerate(packed):
+            if lane[0] >= strip[0]:
+                lowest = n + 1
+        if lowest < len(packed):
+            packed[lowest][0] = strip[1]
+            packed[lowest][1].append(strip)
+        else:
+            packed.append([strip[1], [strip]])
+
+    if len(packed) >= len(tracks):
+        return 0
+
+    for track in tracks:
+        anim.nla_tracks.remove(track)
+    for end, lane in packed:
+        track = anim.nla_tracks.new()
+        track.name = TRACKNAME
+        for start, end, name, action, settings in lane:
+            new = track.strips.new(name, start, action)
+            for prop, value in settings.items():
+                setattr(new, prop, value)
+    return len(tracks) - len(packed)
+
+
+class SCENE_OT_cm_consolidate_nla(Operator):
+    """Move the action strips of the agents onto as few NLA tracks as
+    possible to speed up playback"""
+    bl_idname = "scene.cm_consolidate_nla"
+    bl_label = "Consolidate NLA Tracks"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    onlySelected = BoolProperty(name="Only Selected",
+                                description="Only consolidate the selected agents",
+                                default=False)
+
+    def execute(self, context):
+        objs = bpy.data.objects
+        removed = 0
+        for group in context.scene.cm_groups:
+            for ty in group.agentTypes:
+                for ag in ty.agents:
+                    if ag.name in objs:
+                        obj = objs[ag.name]
+                        if not self.onlySelected or obj.select:
+                            removed += consolidateTracks(obj)
+        self.report({'INFO'}, "Removed {} NLA tracks".format(removed))
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(SCENE_OT_cm_consolidate_nla)
+
+
+def unregister():
+    bpy.utils.unregister_class(SCENE_OT_cm_consolidate_nla)
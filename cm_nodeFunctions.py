@@ -20,32 +20,33 @@
 from collections import OrderedDict
 import math
 from .cm_brainClasses import Neuron, State
-from .cm_pythonEmbededInterpreter import Interpreter
-import copy
+from .cm_impulse import IMPULSES, SingleImpulse, mapImpulses
 import bpy
 import os
-import random
 
 
 """
 class Logic{NAME}(Neuron):
     def core(self, inps, settings):
-        :param inps: list of form [ImpulseContainer |
+        :param inps: list of form [ImpulseContainer | SingleImpulse |
                                    dict of form {str: float | int}, ]
         :param settings: dict of form {str: str | int | float, }
-        :rtype: int | dict of form {str: float | int}
+        :rtype: int | SingleImpulse | ImpulseContainer |
+                dict of form {str: float | int}
 """
 
 
 class LogicINPUT(Neuron):
     """Retrieve information from the scene or about the agent"""
+    namespace = None  # The variables the expression is evaluated with
 
     def core(self, inps, settings):
-        lvars = copy.copy(self.brain.lvars)
-        lvars["math"] = math
-        lvars["inps"] = inps
-        result = eval(settings["Input"], lvars)
-        return result
+        if self.namespace is None:
+            self.namespace = dict(self.brain.lvars)
+            self.namespace["math"] = math
+        # Scripts written before the impulse types may change their inputs
+        self.namespace["inps"] = [dict(into.items()) for into in inps]
+        return settings["Code"].run(self.namespace)
 
 
 class LogicNEWINPUT(Neuron):
@@ -54,7 +55,7 @@ class LogicNEWINPUT(Neuron):
     def core(self, inps, settings):
         channels = self.brain.sim.lvars
         if settings["InputSource"] == "CONSTANT":
-            return {"None": settings["Constant"]}
+            return SingleImpulse(settings["Constant"])
 
         elif settings["InputSource"] == "CROWD":
             if settings["Flocking"] == "SEPARATE":
@@ -62,44 +63,44 @@ class LogicNEWINPUT(Neuron):
                     separateTx = channels["Crowd"].separateTx(inps)
                     if separateTx is None:
                         return None
-                    return {"None": separateTx}
+                    return SingleImpulse(separateTx)
                 elif settings["TranslationAxis"] == "TY":
                     separateTy = channels["Crowd"].separateTy(inps)
                     if separateTy is None:
                         return None
-                    return {"None": separateTy}
+                    return SingleImpulse(separateTy)
                 elif settings["TranslationAxis"] == "TZ":
                     separateTz = channels["Crowd"].separateTz(inps)
                     if separateTz is None:
                         return None
-                    return {"None": separateTz}
+                    return SingleImpulse(separateTz)
             elif settings["Flocking"] == "COHERE":
                 if settings["TranslationAxis"] == "TX":
                     cohereTx = channels["Crowd"].cohereTx(inps)
                     if cohereTx is None:
                         return None
-                    return {"None": cohereTx}
+                    return SingleImpulse(cohereTx)
                 elif settings["TranslationAxis"] == "TY":
                     cohereTy = channels["Crowd"].cohereTy(inps)
                     if cohereTy is None:
                         return None
-                    return {"None": cohereTy}
+                    return SingleImpulse(cohereTy)
                 elif settings["TranslationAxis"] == "TZ":
                     cohereTz = channels["Crowd"].cohereTz(inps)
                     if cohereTz is None:
                         return None
-                    return {"None": cohereTz}
+                    return SingleImpulse(cohereTz)
             else:  # ie. settings["Flocking"] == "ALIGN"
                 if settings["RotationAxis"] == "RZ":
                     alignRz = channels["Crowd"].alignRz(inps)
                     if alignRz is None:
                         return None
-                    return {"None": alignRz}
+                    return SingleImpulse(alignRz)
                 elif settings["RotationAxis"] == "RX":
                     alignRx = channels["Crowd"].alignRx(inps)
                     if alignRx is None:
                         return None
-                    return {"None": alignRx}
+                    return SingleImpulse(alignRx)
 
         elif settings["InputSource"] == "FORMATION":
             fChan = channels["Formation"].retrieve(settings["FormationGroup"])
@@ -110,34 +111,34 @@ class LogicNEWINPUT(Neuron):
                 rz = fChan.rz
                 if rz is None:
                     return None
-                return {"None": rz}
+                return SingleImpulse(rz)
             elif settings["FormationOptions"] == "RX":
                 rx = fChan.rx
                 if rx is None:
                     return None
-                return {"None": rx}
+                return SingleImpulse(rx)
             elif settings["FormationOptions"] == "DIST":
                 dist = fChan.dist
                 if dist is None:
                     return None
-                return {"None": dist}
+                return SingleImpulse(dist)
 
         elif settings["InputSource"] == "GROUND":
             gChan = channels["Ground"].retrieve(settings["GroundGroup"])
-            return {"None": gChan.dh()}
+            return SingleImpulse(gChan.dh())
 
         elif settings["InputSource"] == "NOISE":
             noise = channels["Noise"]
             if settings["NoiseOptions"] == "RANDOM":
-                return {"None": noise.random()}
+                return SingleImpulse(noise.random(self.randomKey))
             elif settings["NoiseOptions"] == "AGENTRANDOM":
-                return {"None": noise.agentRandom(offset=hash(self))}
+                return SingleImpulse(noise.agentRandom(offset=self.randomKey))
 
         elif settings["InputSource"] == "PATH":
             if settings["PathOptions"] == "RZ":
-                return {"None": channels["Path"].rz(settings["PathName"])}
+                return SingleImpulse(channels["Path"].rz(settings["PathName"]))
             elif settings["PathOptions"] == "RX":
-                return {"None": channels["Path"].rx(settings["PathName"])}
+                return SingleImpulse(channels["Path"].rx(settings["PathName"]))
 
         elif settings["InputSource"] == "SOUND":
             sound = channels["Sound"]
@@ -173,38 +174,36 @@ class LogicNEWINPUT(Neuron):
         elif settings["InputSource"] == "STATE":
             state = channels["State"]
             if settings["StateOptions"] == "RADIUS":
-                return {"None": state.radius}
+                return SingleImpulse(state.radius)
             elif settings["StateOptions"] == "SPEED":
-                return {"None": state.speed}
+                return SingleImpulse(state.speed)
             elif settings["StateOptions"] == "GLOBALVELX":
-                return {"None": state.velocity.x}
+                return SingleImpulse(state.velocity.x)
             elif settings["StateOptions"] == "GLOBALVELY":
-                return {"None": state.velocity.y}
+                return SingleImpulse(state.velocity.y)
             elif settings["StateOptions"] == "GLOBALVELZ":
-                return {"None": state.velocity.z}
+                return SingleImpulse(state.velocity.z)
 
         elif settings["InputSource"] == "WORLD":
             world = channels["World"]
             if settings["WorldOptions"] == "TARGET":
                 if settings["TargetOptions"] == "RZ":
                     tgt = world.target(settings["TargetObject"])
-                    return {"None": tgt.rz}
+                    return SingleImpulse(tgt.rz)
                 elif settings["TargetOptions"] == "RX":
                     tgt = world.target(settings["TargetObject"])
-                    return {"None": tgt.rx}
+                    return SingleImpulse(tgt.rx)
                 elif settings["TargetOptions"] == "ARRIVED":
                     tgt = world.target(settings["TargetObject"])
-                    return {"None": tgt.arrived}
+                    return SingleImpulse(tgt.arrived)
             elif settings["WorldOptions"] == "TIME":
-                return {"None": channels["World"].time}
+                return SingleImpulse(channels["World"].time)
 
 
 class LogicGRAPH(Neuron):
     """Return value 0 to 1 mapping from graph"""
 
     def core(self, inps, settings):
-        preferences = bpy.context.user_preferences.addons[__package__].preferences
-
         def linear(value):
             lz = settings["LowerZero"]
             lo = settings["LowerOne"]
@@ -229,36 +228,44 @@ class LogicGRAPH(Neuron):
             a = math.log(0.1) / (TPP**2)
             return math.e**(a*(value-u)**2)
 
+        if settings["CurveType"] == "RBF":
+            def curve(value):
+                return RBF(value) * settings["Multiply"]
+        elif settings["CurveType"] == "RANGE":
+            def curve(value):
+                return linear(value) * settings["Multiply"]
+        else:
+            # cubic bezier could also be an option here (1/2 sided)
+            return {}
+
+        if len(inps) == 1 and isinstance(inps[0], IMPULSES):
+            return inps[0].map(curve)
         output = {}
         for into in inps:
-            for i in into:
+            for i, v in into.items():
                 if i in output:
+                    preferences = bpy.context.user_preferences.addons[__package__].preferences
                     if preferences.show_debug_options:
                         print("""LogicGRAPH data lost due to multiple inputs with the same key""")
                 else:
-                    if settings["CurveType"] == "RBF":
-                        output[i] = (RBF(into[i])*settings["Multiply"])
-                    elif settings["CurveType"] == "RANGE":
-                        output[i] = (linear(into[i])*settings["Multiply"])
-                    # cubic bezier could also be an option here (1/2 sided)
+                    output[i] = curve(v)
         return output
 
+
 class LogicMATH(Neuron):
     """returns the values added/subtracted/multiplied/divided together"""
     
     def core(self, inps, settings):
-        result = {}
-        for into in inps:
-            for i in into:
-                if settings["operation"] == "add":
-                    result[i] = into[i] + settings["num1"]
-                elif settings["operation"] == "sub":
-                    result[i] = into[i] - settings["num1"]
-                elif settings["operation"] == "mul":
-                    result[i] = into[i] * settings["num1"]
-                elif settings["operation"] == "div":
-                    result[i] = into[i] / settings["num1"]
-        return result
+        num = settings["num1"]
+        if settings["operation"] == "add":
+            return mapImpulses(inps, lambda v: v + num)
+        elif settings["operation"] == "sub":
+            return mapImpulses(inps, lambda v: v - num)
+        elif settings["operation"] == "mul":
+            return mapImpulses(inps, lambda v: v * num)
+        elif settings["operation"] == "div":
+            return mapImpulses(inps, lambda v: v / num)
+        return {}
 
 
 class LogicAND(Neuron):
@@ -267,19 +274,19 @@ class LogicAND(Neuron):
     def core(self, inps, settings):
         results = {}
         for into in inps:
-            for i in into:
+            for i, v in into.items():
                 if i in results:
                     if settings["Method"] == "MUL":
-                        results[i] *= into[i]
+                        results[i] *= v
                     else:  # Method == "MIN"
-                        results[i] = min(results[i], into[i])
+                        results[i] = min(results[i], v)
                 else:
                     inAll = True
                     if settings["IncludeAll"]:
                         for intoB in inps:
                             inAll &= i in intoB
                     if inAll:
-                        results[i] = into[i]
+                        results[i] = v
 
         if settings["SingleOutput"]:
             total = 1
@@ -290,7 +297,7 @@ class LogicAND(Neuron):
                     total *= v
             else:  # Method == "MIN"
                 total = min(results)
-            return {"None": total}
+            return SingleImpulse(total)
         else:
             return results
 
@@ -307,24 +314,24 @@ class LogicOR(Neuron):
                 total = 0
             for into in inps:
                 if settings["Method"] == "MUL":
-                    for i in [into[i] for i in into]:
-                        total *= (1-i)
+                    for v in into.values():
+                        total *= (1-v)
                 else:  # Method == "MAX"
-                    total = max(list(into.values()) + [total])
+                    total = max(total, max(into.values(), default=total))
             if settings["Method"] == "MUL":
                 total = 1 - total
             return total
         else:
             results = {}
             for into in inps:
-                for i in into:
+                for i, v in into.items():
                     if i in results:
                         if settings["Method"] == "MUL":
-                            results[i] *= (1-into[i])
+                            results[i] *= (1-v)
                         else:  # Method == "MAX"
-                            results[i] = min(1-results[i], 1-into[i])
+                            results[i] = min(1-results[i], 1-v)
                     else:
-                        results[i] = (1-into[i])
+                        results[i] = (1-v)
             results.update((k, 1-v) for k, v in results.items())
             return results
 
@@ -334,11 +341,7 @@ class LogicSTRONG(Neuron):
     # https://www.desmos.com/calculator/izfhogpchr
 
     def core(self, inps, settings):
-        results = {}
-        for into in inps:
-            for i in into:
-                results[i] = into[i]**2 * (-2*into[i] + 3)
-        return results
+        return mapImpulses(inps, lambda v: v**2 * (-2*v + 3))
 
 
 class LogicWEAK(Neuron):
@@ -346,11 +349,7 @@ class LogicWEAK(Neuron):
     # https://www.desmos.com/calculator/izfhogpchr
 
     def core(self, inps, settings):
-        results = {}
-        for into in inps:
-            for i in into:
-                results[i] = 2*into[i] - (into[i]**2 * (-2*into[i] + 3))
-        return results
+        return mapImpulses(inps, lambda v: 2*v - (v**2 * (-2*v + 3)))
 
 
 class LogicQUERYTAG(Neuron):
@@ -373,24 +372,22 @@ class LogicSETTAG(Neuron):
         total = 0
         count = 0
         for into in inps:
-            for i in into:
-                if into[i] > settings["Threshold"]:
+            for v in into.values():
+                if v > settings["Threshold"]:
                     condition = True
-                total += into[i]
+                total += v
                 count += 1
         if settings["UseThreshold"]:
             if condition:
                 if settings["Action"] == "ADD":
-                    self.brain.tags[settings["Tag"]] = 1
+                    self.brain.setTag(settings["Tag"], 1)
                 else:
-                    if settings["Tag"] in self.brain.tags:
-                        del self.brain.tags[settings["Tag"]]
+                    self.brain.removeTag(settings["Tag"])
         else:
             if settings["Action"] == "ADD":
-                self.brain.tags[settings["Tag"]] = total
+                self.brain.setTag(settings["Tag"], total)
             else:
-                if settings["Tag"] in self.brain.tags:
-                    del self.brain.tags[settings["Tag"]]
+                self.brain.removeTag(settings["Tag"])
         return settings["Threshold"]
 
 
@@ -400,8 +397,8 @@ class LogicVARIABLE(Neuron):
     def core(self, inps, settings):
         count = 0
         for into in inps:
-            for i in into:
-                self.brain.agvars[settings["Variable"]] += into[i]
+            for v in into.values():
+                self.brain.agvars[settings["Variable"]] += v
                 count += 1
         if count:
             self.brain.agvars[settings["Variable"]] /= count
@@ -422,48 +419,48 @@ class LogicFILTER(Neuron):
         # TODO what if multiple inputs have the same keys?
         if self.settings["Operation"] == "EQUAL":
             for into in inps:
-                for i in into:
-                    if into[i] == self.settings["Value"]:
-                        result[i] = into[i]
+                for i, v in into.items():
+                    if v == self.settings["Value"]:
+                        result[i] = v
         elif self.settings["Operation"] == "NOT EQUAL":
             for into in inps:
-                for i in into:
-                    if into[i] != self.settings["Value"]:
-                        result[i] = into[i]
+                for i, v in into.items():
+                    if v != self.settings["Value"]:
+                        result[i] = v
         elif self.settings["Operation"] == "LESS":
             for into in inps:
-                for i in into:
-                    if into[i] <= self.settings["Value"]:
-                        result[i] = into[i]
+                for i, v in into.items():
+                    if v <= self.settings["Value"]:
+                        result[i] = v
         elif self.settings["Operation"] == "GREATER":
             for into in inps:
-                for i in into:
-                    if into[i] > self.settings["Value"]:
-                        result[i] = into[i]
+                for i, v in into.items():
+                    if v > self.settings["Value"]:
+                        result[i] = v
         elif self.settings["Operation"] == "LEAST":
             leastVal = -float("inf")
             leastName = "None"
             for into in inps:
-                for i in into:
-                    if into[i] < leastVal:
-                        leastVal = into[i]
+                for i, v in into.items():
+                    if v < leastVal:
+                        leastVal = v
                         leastName = i
             result = {leastName: leastVal}
         elif self.settings["Operation"] == "MOST":
             mostVal = -float("inf")
             mostName = "None"
             for into in inps:
-                for i in into:
-                    if into[i] > mostVal:
-                        mostVal = into[i]
+                for i, v in into.items():
+                    if v > mostVal:
+                        mostVal = v
                         mostName = i
             result = {mostName: mostVal}
         elif self.settings["Operation"] == "AVERAGE":
             total = 0
             count = 0
             for into in inps:
-                for i in into:
-                    total += into[i]
+                for i, v in into.items():
+                    total += v
                     count += 1
             if count != 0:
                 result = {"None": total/count}
@@ -475,49 +472,46 @@ class LogicMAP(Neuron):
     (extrapolates outside of input range)"""
 
     def core(self, inps, settings):
-        result = {}
-        if settings["LowerInput"] != settings["UpperInput"]:
-            for into in inps:
-                for i in into:
-                    num = into[i]
-                    li = settings["LowerInput"]
-                    ui = settings["UpperInput"]
-                    lo = settings["LowerOutput"]
-                    uo = settings["UpperOutput"]
-                    result[i] = ((uo - lo) / (ui - li)) * (num - li) + lo
-        return result
+        li = settings["LowerInput"]
+        ui = settings["UpperInput"]
+        lo = settings["LowerOutput"]
+        uo = settings["UpperOutput"]
+        if li == ui:
+            return {}
+        scale = (uo - lo) / (ui - li)
+        return mapImpulses(inps, lambda num: scale * (num - li) + lo)
 
 
 class LogicOUTPUT(Neuron):
     """Sets an agents output. (Has to be picked up in cm_agents.Agents)"""
 
     def core(self, inps, settings):
-        preferences = bpy.context.user_preferences.addons[__package__].preferences
         val = 0
         if settings["MultiInputType"] == "AVERAGE":
             count = 0
             for into in inps:
-                for i in into:
-                    val += into[i]
+                for v in into.values():
+                    val += v
                     count += 1
             out = val/(max(1, count))
         elif settings["MultiInputType"] == "MAX":
             out = 0
             for into in inps:
-                for i in into:
-                    if abs(into[i]) > abs(out):
-                        out = into[i]
+                for v in into.values():
+                    if abs(v) > abs(out):
+                        out = v
         elif settings["MultiInputType"] == "SIZEAVERAGE":
             """Takes a weighed average of the inputs where smaller values have
             less of an impact on the final result"""
+            preferences = bpy.context.user_preferences.addons[__package__].preferences
             Sm = 0
             SmSquared = 0
             for into in inps:
-                for i in into:
+                for v in into.values():
                     if preferences.show_debug_options:
-                        print("Val:", into[i])
-                    Sm += into[i]
-                    SmSquared += into[i] * abs(into[i])  # To retain sign
+                        print("Val:", v)
+                    Sm += v
+                    SmSquared += v * abs(v)  # To retain sign
             # print(Sm, SmSquared)
             if Sm == 0:
                 out = 0
@@ -526,8 +520,8 @@ class LogicOUTPUT(Neuron):
         elif settings["MultiInputType"] == "SUM":
             out = 0
             for into in inps:
-                for i in into:
-                    out += into[i]
+                for v in into.values():
+                    out += v
         self.brain.outvars[settings["Output"]] = out
         return out
 
@@ -545,26 +539,27 @@ class LogicPRIORITY(Neuron):
                 priority = inps[2*v+1]
                 usesPriority = True
             else:
-                priority = []
+                priority = {}
                 usesPriority = False
             # print("priority", priority)
-            for i in into:
-                if i in priority:
-                    # TODO what if priority[i] < 0?
+            for i, val in into.items():
+                p = priority.get(i)
+                if p is not None:
+                    # TODO what if p < 0?
                     if i in result:
-                        contribution = priority[i] * remaining[i]
-                        result[i] += into[i] * contribution
+                        contribution = p * remaining[i]
+                        result[i] += val * contribution
                         remaining[i] -= contribution
                     else:
-                        result[i] = into[i] * priority[i]
-                        remaining[i] = 1 - priority[i]
+                        result[i] = val * p
+                        remaining[i] = 1 - p
                 elif not usesPriority:
                     if i in result:
                         contribution = remaining[i]
-                        result[i] += into[i] * contribution
+                        result[i] += val * contribution
                         remaining[i] -= 0
                     else:
-                        result[i] = into[i]
+                        result[i] = val
                         remaining[i] = 0
             # print("resultPartial", result)
         for key, rem in remaining.items():
@@ -602,19 +597,16 @@ class LogicEVENT(Neuron):
 
 class LogicPYTHON(Neuron):
     """execute a python expression"""
+    namespace = None  # The variables the script is run with
 
     def core(self, inps, settings):
-        global Inter
-        setup = copy.copy(self.brain.lvars)
-        setup["inps"] = inps
-        setup["settings"] = settings
-        Inter.setup(setup)
-        Inter.enter(settings["Expression"]["value"])
-        result = Inter.getoutput()
-        return result
-
-
-Inter = Interpreter()
+        if self.namespace is None:
+            self.namespace = {'__name__': '__console__', '__doc__': None}
+            self.namespace.update(self.brain.lvars)
+            self.namespace["settings"] = settings
+        # Scripts written before the impulse types may change their inputs
+        self.namespace["inps"] = [dict(into.items()) for into in inps]
+        return settings["Code"].run(self.namespace)
 
 
 class LogicPRINT(Neuron):
@@ -624,13 +616,13 @@ class LogicPRINT(Neuron):
         selected = [o.name for o in bpy.context.selected_objects]
         if self.brain.userid in selected:
             for into in inps:
-                for i in into:
+                for i, v in into.items():
                     if settings["save_to_file"] == True:
                         with open(os.path.join(settings["output_filepath"], "CrowdMasterOutput.txt"), "a") as output:
-                            message = settings["Label"] + " >> " + str(i) + " " + str(into[i]) + "\n"
+                            message = settings["Label"] + " >> " + str(i) + " " + str(v) + "\n"
                             output.write(message)
                     else:
-                        print(settings["Label"], ">>", i, into[i])
+                        print(settings["Label"], ">>", i, v)
         return 0
 
 
@@ -638,6 +630,14 @@ class LogicAction(Neuron):
     pass
 
 
+class LogicCONSTANT(Neuron):
+    """A node that was folded into a constant when the brain was compiled
+    (see BrainProgram.foldConstants). Has no node in the editor"""
+
+    def core(self, inps, settings):
+        return settings["Value"]
+
+
 logictypes = OrderedDict([
     ("InputNode", LogicINPUT),
     ("NewInputNode", LogicNEWINPUT),
@@ -672,15 +672,7 @@ class StateAction(State):
         act = self.actionName
         if act in self.brain.sim.actions:
             actionobj = self.brain.sim.actions[act]  # from .cm_motion.py
-            obj = bpy.context.scene.objects[self.brain.userid]  # bpy object
-
-            tr = obj.animation_data.nla_tracks.new()  # NLA track
-            action = actionobj.action  # bpy action
-            if action:
-                currentFrame = bpy.context.scene.frame_current
-                strip = tr.strips.new("", currentFrame, action)
-                strip.extrapolation = 'NOTHING'
-                strip.use_auto_blend = True
+            self.brain.sim.placeAction(self.brain.userid, act)
             self.length = actionobj.length
 
             """tr = obj.animation_data.nla_tracks.new()  # NLA track
@@ -704,8 +696,7 @@ class StateAction(State):
         else:
             complete = self.currentFrame/self.length
             complete = 0.5 + complete/2
-        currentFrame = bpy.context.scene.frame_current
-        self.resultLog[currentFrame] = ((0.15, 0.4, complete))
+        self.logComplete(complete)
 
         if self.actionName in self.brain.sim.actions:
             actionobj = self.brain.sim.actions[self.actionName]
@@ -758,20 +749,13 @@ class StateActionGroup(State):
 
         actGp = self.brain.sim.actionGroups[self.settings["GroupName"]]
 
-        self.actionName = random.choice(actGp)
+        choice = int(self.brain.random(self.randomKey) * len(actGp))
+        self.actionName = actGp[choice]
 
         act = self.actionName
         if act in self.brain.sim.actions:
             actionobj = self.brain.sim.actions[act]  # from .cm_motion.py
-            obj = bpy.context.scene.objects[self.brain.userid]  # bpy object
-
-            tr = obj.animation_data.nla_tracks.new()  # NLA track
-            action = actionobj.action  # bpy action
-            if action:
-                currentFrame = bpy.context.scene.frame_current
-                strip = tr.strips.new("", currentFrame, action)
-                strip.extrapolation = 'NOTHING'
-                strip.use_auto_blend = True
+            self.brain.sim.placeAction(self.brain.userid, act)
             self.length = actionobj.length
 
     def evaluateState(self):
@@ -784,8 +768,7 @@ class StateActionGroup(State):
         else:
             complete = self.currentFrame/self.length
             complete = 0.5 + complete/2
-        currentFrame = bpy.context.scene.frame_current
-        self.resultLog[currentFrame] = ((0.15, 0.4, complete))
+        self.logComplete(complete)
 
         if self.actionName in self.brain.sim.actions:
             actionobj = self.brain.sim.actions[self.actionName]
@@ -0,0 +1,79 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""Evaluate the brains of the agents in several processes.
+
+The worker processes are forked from Blender at the start of each frame so
+they see exactly the state of the simulation at the end of the last frame
+(the read snapshot). Each one evaluates the brains of a shard of the agents
+and sends back what the brains changed (the write buffer) which is merged
+into the main process before the agents move."""
+
+import multiprocessing
+
+_sim = None  # The simulation as it was when the workers were forked
+
+
+def canFork():
+    """Forking is needed so that the workers have access to bpy"""
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def shard(items, count):
+    """Split items into count contiguous parts"""
+    size = -(-len(items) // count)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _evaluateShard(names):
+    """Run in a worker process"""
+    sim = _sim
+    sim.isWorker = True
+    sim.deferredActions = []
+    results = []
+    for name in names:
+        agent = sim.agents[name]
+        agent.brain.execute()
+        results.append((name, agent.brain.getState()))
+    channels = {k: ch.workerState() for k, ch in sim.lvars.items()}
+    return results, sim.deferredActions, channels
+
+
+def evaluate(sim, names, processes):
+    """Evaluate the brains of the named agents using a pool of processes
+
+    :returns: [(agent name, brain state)], [deferred actions],
+              [{channel name: channel worker state}] (one per shard)"""
+    global _sim
+    _sim = sim
+    ctx = multiprocessing.get_context("fork")
+    shards = shard(names, processes)
+    try:
+        with ctx.Pool(len(shards)) as pool:
+            shardResults = pool.map(_evaluateShard, shards)
+    finally:
+        _sim = None
+    results = []
+    actions = []
+    channels = []
+    for res, act, chan in shardResults:
+        results += res
+        actions += act
+        channels.append(chan)
+    return results, actions, channels
@@ -0,0 +1,226 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import bpy
+from bpy.props import StringProperty, BoolProperty, IntProperty
+from bpy.types import Operator
+
+from .cm_agentStore import AgentStore
+from .cm_trajectory import TrajectoryWriter, TrajectoryCache, COLUMNS
+
+"""The fcurve that each column of the trajectory cache is baked from"""
+FCURVES = {"apx": ("location", 0), "apy": ("location", 1),
+           "apz": ("location", 2), "arx": ("rotation_euler", 0),
+           "ary": ("rotation_euler", 1), "arz": ("rotation_euler", 2)}
+
+
+def bakedFCurves(obj):
+    """The fcurves of obj that the trajectory cache replaces"""
+    anim = obj.animation_data
+    if anim is None or anim.action is None:
+        return []
+    return [fc for fc in anim.action.fcurves
+            if fc.data_path in ("location", "rotation_euler")]
+
+
+class Player:
+    """Moves the agents to the positions stored in a trajectory cache
+    whenever the frame changes. The location and rotation fcurves of the
+    agents are muted while playing as the animation is evaluated after the
+    handler and would move the agents back"""
+    def __init__(self, directory):
+        self.cache = TrajectoryCache(directory)
+        objs = bpy.data.objects
+        self.objects = [objs.get(n) for n in self.cache.names]
+        self.muted = []  # [(object name, data_path, array_index)]
+
+    def frameChangeHandler(self, scene):
+        data = self.cache.frame(scene.frame_current)
+        if data is None:
+            return
+        values, states = data
+        width = len(COLUMNS)
+        for i, obj in enumerate(self.objects):
+            if obj is not None:
+                row = values[i * width:(i + 1) * width]
+                obj.location = tuple(row[0:3])
+                obj.rotation_euler = tuple(row[3:6])
+
+    def start(self):
+        for obj in self.objects:
+            if obj is not None:
+                for fc in bakedFCurves(obj):
+                    if not fc.mute:
+                        fc.mute = True
+                        self.muted.append((obj.name, fc.data_path,
+                                           fc.array_index))
+        bpy.app.handlers.frame_change_pre.append(self.frameChangeHandler)
+
+    def stop(self):
+        if self.frameChangeHandler in bpy.app.handlers.frame_change_pre:
+            bpy.app.handlers.frame_change_pre.remove(self.frameChangeHandler)
+        objs = bpy.data.objects
+        for name, dataPath, index in self.muted:
+            obj = objs.get(name)
+            if obj is not None:
+                for fc in bakedFCurves(obj):
+                    if fc.data_path == dataPath and fc.array_index == index:
+                        fc.mute = False
+        self.muted = []
+        self.cache.close()
+
+
+player = None
+
+
+def stopPlayback():
+    global player
+    if player is not None:
+        player.stop()
+        player = None
+
+
+def agentNames(scene):
+    names = []
+    for group in scene.cm_groups:
+        for ty in group.agentTypes:
+            for ag in ty.agents:
+                if ag.name in bpy.data.objects:
+                    names.append(ag.name)
+    return names
+
+
+class SCENE_OT_cm_bake_trajectories(Operator):
+    """Write the animation of the agents to a trajectory cache"""
+    bl_idname = "scene.cm_bake_trajectories"
+    bl_label = "Bake Trajectories"
+
+    directory = StringProperty(subtype='DIR_PATH')
+    frameStart = IntProperty(name="Start Frame", default=-1,
+                             description="First frame (-1 for scene start)")
+    frameEnd = IntProperty(name="End Frame", default=-1,
+                           description="Last frame (-1 for scene end)")
+    clearKeyframes = BoolProperty(name="Remove Keyframes", default=False,
+                                  description="Remove the location and rotation keyframes of the agents once they are in the cache")
+
+    def invoke(self, context, event):
+        preferences = context.user_preferences.addons[__package__].preferences
+        if not self.directory:
+            self.directory = bpy.path.abspath(preferences.trajectory_path)
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        scene = context.scene
+        preferences = context.user_preferences.addons[__package__].preferences
+        frameStart = scene.frame_start if self.frameStart < 0 else self.frameStart
+        frameEnd = scene.frame_end if self.frameEnd < 0 else self.frameEnd
+        directory = self.directory or bpy.path.abspath(preferences.trajectory_path)
+
+        objs = bpy.data.objects
+        names = agentNames(scene)
+        store = AgentStore()
+        store.reserve(len(names))
+        curves = []  # [(column, slot, fcurve or constant value)]
+        for name in names:
+            slot = store.allocate(name)
+            obj = objs[name]
+            anim = obj.animation_data
+            for col in COLUMNS:
+                dataPath, index = FCURVES[col]
+                fc = None
+                if anim is not None and anim.action is not None:
+                    fc = anim.action.fcurves.find(dataPath, index)
+                if fc is None:
+                    getattr(store, col)[slot] = getattr(obj, dataPath)[index]
+                else:
+                    curves.append((getattr(store, col), slot, fc))
+
+        writer = TrajectoryWriter(directory, names, frameStart,
+                                  preferences.trajectory_chunk_size)
+        states = [None] * len(names)
+        for frame in range(frameStart, frameEnd + 1):
+            for column, slot, fc in curves:
+                column[slot] = fc.evaluate(frame)
+            writer.record(frame, store, states)
+        writer.flush()
+
+        if self.clearKeyframes:
+            for name in names:
+                obj = objs[name]
+                for fc in bakedFCurves(obj):
+                    obj.animation_data.action.fcurves.remove(fc)
+
+        self.report({'INFO'}, "Baked {} agents to {}".format(len(names),
+                                                             directory))
+        return {'FINISHED'}
+
+
+class SCENE_OT_cm_playback_start(Operator):
+    """Play the agents back from a trajectory cache instead of keyframes"""
+    bl_idname = "scene.cm_playback_start"
+    bl_label = "Play From Cache"
+
+    directory = StringProperty(subtype='DIR_PATH')
+
+    def invoke(self, context, event):
+        preferences = context.user_preferences.addons[__package__].preferences
+        if not self.directory:
+            self.directory = bpy.path.abspath(preferences.trajectory_path)
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        global player
+        stopPlayback()
+        try:
+            player = Player(self.directory)
+        except (OSError, ValueError) as e:
+            self.report({'ERROR'}, "Couldn't open trajectory cache: " + str(e))
+            return {'CANCELLED'}
+        player.start()
+        player.frameChangeHandler(context.scene)
+        return {'FINISHED'}
+
+
+class SCENE_OT_cm_playback_stop(Operator):
+    """Stop playing the agents from a trajectory cache"""
+    bl_idname = "scene.cm_playback_stop"
+    bl_label = "Stop Playing From Cache"
+
+    @classmethod
+    def poll(cls, context):
+        return player is not None
+
+    def execute(self, context):
+        stopPlayback()
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_class(SCENE_OT_cm_bake_trajectories)
+    bpy.utils.register_class(SCENE_OT_cm_playback_start)
+    bpy.utils.register_class(SCENE_OT_cm_playback_stop)
+
+
+def unregister():
+    stopPlayback()
+    bpy.utils.unregister_class(SCENE_OT_cm_bake_trajectories)
+    bpy.utils.unregister_class(SCENE_OT_cm_playback_start)
+    bpy.utils.unregister_class(SCENE_OT_cm_playback_stop)
@@ -116,8 +116,143 @@ class CMPreferences(AddonPreferences):
         default=True,
         )
 
+    sim_processes = IntProperty(
+        name="Processes",
+        description="Number of processes used to evaluate the agents brains. Above 1 the agents are split between processes forked from Blender (not available on Windows).",
+        default=1,
+        min=1,
+        max=64,
+        )
+
+    use_profiler = BoolProperty(
+        name="Profile Simulation",
+        description="Record the time spent in each node type, channel and in writing keyframes. The results can be exported as JSON or as a Chrome trace.",
+        default=False,
+        )
+
+    checkpoint_interval = IntProperty(
+        name="Checkpoint Interval",
+        description="Save the state of the simulation every this many frames so that it can be resumed (0 to disable).",
+        default=0,
+        min=0,
+        )
+
+    checkpoint_path = StringProperty(
+        name="Checkpoint Folder",
+        description="Where the simulation checkpoints are saved.",
+        default="//cm_checkpoints/",
+        subtype='DIR_PATH',
+        )
+
+    use_snapshot_cache = BoolProperty(
+        name="Snapshot Cache",
+        description="Keep the state of the simulation for each frame in memory so that scrubbing backwards re-simulates from the nearest earlier frame instead of needing a restart.",
+        default=False,
+        )
+
+    snapshot_budget = IntProperty(
+        name="Snapshot Memory (MB)",
+        description="Memory used by the snapshot cache. When it is full the snapshots furthest from the playhead are removed.",
+        default=256,
+        min=1,
+        )
+
+    brain_engine = EnumProperty(
+        name="Brain Engine",
+        description="How the brains of the agents are evaluated.",
+        items=[("NEURON", "Per Agent", "Evaluate each agents brain on its own"),
+               ("VECTOR", "Vectorized", "Evaluate each node for all the agents with the same brain at once (uses numpy if it is installed)"),
+               ("CODEGEN", "Generated Code", "Evaluate each agents brain with Python code generated for its node group")],
+        default="NEURON",
+        )
+
+    optimise_brains = BoolProperty(
+        name="Optimise Brains",
+        description="Work out constant nodes once when the brain is compiled and skip nodes that can't affect the agent.",
+        default=True,
+        )
+
+    keyframe_flush_interval = IntProperty(
+        name="Keyframe Flush Interval",
+        description="How many frames to simulate between writing the agents keyframes. The agents don't appear to move until their keyframes are written. 0 to only write them when the simulation stops.",
+        default=25,
+        min=0,
+        )
+
+    use_trajectory_cache = BoolProperty(
+        name="Trajectory Cache",
+        description="Record the location, rotation and state of every agent to a binary cache that can be read without loading the keyframes.",
+        default=False,
+        )
+
+    trajectory_path = StringProperty(
+        name="Trajectory Cache Folder",
+        description="The folder the trajectory cache is written to.",
+        default="//cm_trajectories/",
+        subtype='DIR_PATH',
+        )
+
+    trajectory_chunk_size = IntProperty(
+        name="Chunk Size",
+        description="The number of frames in each file of the trajectory cache.",
+        default=100,
+        min=1,
+        )
+
+    use_lod = BoolProperty(
+        name="Level Of Detail",
+        description="Evaluate the brains of agents that are far from the active camera or outside of its view less often. Their movement is continued from their last velocity in between.",
+        default=False,
+        )
+
+    lod_near = FloatProperty(
+        name="Near Distance",
+        description="Agents closer than this to the camera are evaluated every frame.",
+        default=20.0,
+        min=0.0,
+        )
+
+    lod_far = FloatProperty(
+        name="Far Distance",
+        description="Agents further than this from the camera are evaluated as little as possible.",
+        default=200.0,
+        min=0.0,
+        )
+
+    lod_max_interval = IntProperty(
+        name="Max Interval",
+        description="The most frames between evaluations of an agents brain.",
+        default=8,
+        min=1,
+        )
+
+    random_seed = IntProperty(
+        name="Random Seed",
+        description="Change to get different random numbers in the brains.",
+        default=0,
+        min=0,
+        )
+
+    telemetry_mode = EnumProperty(
+        name="Record Telemetry",
+        description="The agents to record the results of the nodes of for the node colors.",
+        items=[("NONE", "None", "Don't record any agents"),
+               ("ACTIVE", "Active", "Record the active agent"),
+               ("SELECTED", "Selected", "Record the selected agents"),
+               ("ALL", "All", "Record every agent (slow)")],
+        default="SELECTED",
+        )
+
+    telemetry_frames = IntProperty(
+        name="Telemetry Frames",
+        description="The number of frames of telemetry kept for each recorded agent.",
+        default=250,
+        min=1,
+        )
+
     prefs_tab_items = [
         ("GEN", "General Settings", "General settings for the addon."),
+        ("SIM", "Simulation Settings", "Settings for how simulations are run."),
         ("UPDATE", "Addon Update Settings", "Settings for the addon updater."),
         ("DEBUG", "Debug Options", "Debug settings and utilities.")]
 
@@ -155,6 +290,47 @@ class CMPreferences(AddonPreferences):
             else:
                 row.prop(preferences, 'show_debug_options', icon='RECOVER_AUTO')
 
+        if preferences.prefs_tab == "SIM":
+            row = layout.row()
+            row.prop(preferences, 'sim_processes')
+            row.prop(preferences, 'use_profiler', icon='TIME')
+
+            row = layout.row()
+            row.prop(preferences, 'checkpoint_interval')
+            row.prop(preferences, 'checkpoint_path')
+
+            row = layout.row()
+            row.prop(preferences, 'brain_engine')
+            row.prop(preferences, 'optimise_brains')
+
+            row = layout.row()
+            row.prop(preferences, 'keyframe_flush_interval')
+
+            row = layout.row()
+            row.prop(preferences, 'use_trajectory_cache', icon='DISK_DRIVE')
+            if preferences.use_trajectory_cache:
+                row.prop(preferences, 'trajectory_path')
+                row.prop(preferences, 'trajectory_chunk_size')
+
+            row = layout.row()
+            row.prop(preferences, 'use_lod', icon='CAMERA_DATA')
+            if preferences.use_lod:
+                row.prop(preferences, 'lod_near')
+                row.prop(preferences, 'lod_far')
+                row.prop(preferences, 'lod_max_interval')
+
+            row = layout.row()
+            row.prop(preferences, 'random_seed')
+
+            row = layout.row()
+            row.prop(preferences, 'telemetry_mode')
+            row.prop(preferences, 'telemetry_frames')
+
+            row = layout.row()
+            row.prop(preferences, 'use_snapshot_cache', icon='RECOVER_LAST')
+            if preferences.use_snapshot_cache:
+                row.prop(preferences, 'snapshot_budget')
+
         if preferences.prefs_tab == "UPDATE":
             layout.row()
             addon_updater_ops.update_settings_ui(self, context)
@@ -0,0 +1,182 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import bpy
+import json
+import time
+from functools import wraps
+from bpy.props import StringProperty, EnumProperty
+from bpy.types import Operator
+
+activeProfiler = None
+"""The profiler of the running simulation (None when not profiling). The
+instrumented code only checks this so there is almost no cost when off"""
+
+clock = time.perf_counter
+
+
+class Profiler:
+    """Records where the time of each frame of the simulation is spent"""
+    def __init__(self, maxSpans=1000000):
+        self.origin = clock()
+        self.frame = 0
+        self.frames = 0
+        self.totals = {}  # {(category, name): [calls, seconds]}
+        self.spans = []  # [(category, name, start, duration, frame)]
+        self.maxSpans = maxSpans  # Only the totals are kept after this
+
+    def newFrame(self, frame):
+        self.frame = frame
+        self.frames += 1
+
+    def add(self, category, name, start, end):
+        """Record that name was running from start to end"""
+        key = (category, name)
+        if key in self.totals:
+            total = self.totals[key]
+            total[0] += 1
+            total[1] += end - start
+        else:
+            self.totals[key] = [1, end - start]
+        if len(self.spans) < self.maxSpans:
+            self.spans.append((category, name, start - self.origin,
+                               end - start, self.frame))
+
+    def report(self):
+        """The totals sorted by the time spent (most first)
+
+        :rtype: list of dict"""
+        result = []
+        frames = max(self.frames, 1)
+        for (category, name), (calls, seconds) in self.totals.items():
+            result.append({"category": category,
+                           "name": name,
+                           "calls": calls,
+                           "time": seconds,
+                           "timePerFrame": seconds / frames})
+        result.sort(key=lambda r: r["time"], reverse=True)
+        return result
+
+    def exportJSON(self, filepath):
+        with open(filepath, "w") as f:
+            json.dump({"frames": self.frames, "totals": self.report()}, f,
+                      indent=2)
+
+    def exportChromeTrace(self, filepath):
+        """Write the spans in the format used by chrome://tracing"""
+        events = []
+        for category, name, start, duration, frame in self.spans:
+            events.append({"name": name,
+                           "cat": category,
+                           "ph": "X",
+                           "ts": start * 1000000,
+                           "dur": duration * 1000000,
+                           "pid": 1,
+                           "tid": 1,
+                           "args": {"frame": frame}})
+        with open(filepath, "w") as f:
+            json.dump({"traceEvents": events}, f)
+
+
+class section:
+    """Time a block of code. Does nothing when not profiling
+
+    with section("simulation", "Agent.apply"):
+        ..."""
+    __slots__ = ("category", "name", "start")
+
+    def __init__(self, category, name):
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+
+    def __exit__(self, *args):
+        if activeProfiler is not None:
+            activeProfiler.add(self.category, self.name, self.start, clock())
+
+
+def profiled(name, category="channel"):
+    """Decorator to time every call of a function"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if activeProfiler is None:
+                return func(*args, **kwargs)
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                activeProfiler.add(category, name, start, clock())
+        return wrapper
+    return decorator
+
+
+class SCENE_OT_cm_profiler_export(Operator):
+    """Save the timings from the last profiled simulation"""
+    bl_idname = "scene.cm_profiler_export"
+    bl_label = "Export Profile"
+
+    filepath = StringProperty(subtype='FILE_PATH')
+    exportFormat = EnumProperty(name="Format",
+                                items=[("JSON", "JSON", "Totals per node type and channel"),
+                                       ("CHROME", "Chrome Trace", "Every timed call, for chrome://tracing")])
+
+    @classmethod
+    def poll(cls, context):
+        return lastProfiler is not None
+
+    def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = bpy.path.abspath("//crowdmaster_profile.json")
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        if self.exportFormat == "CHROME":
+            lastProfiler.exportChromeTrace(self.filepath)
+        else:
+            lastProfiler.exportJSON(self.filepath)
+        self.report({'INFO'}, "Profile saved to " + self.filepath)
+        return {'FINISHED'}
+
+
+lastProfiler = None  # Kept after the simulation stops so it can be exported
+
+
+def start():
+    """Start profiling a new simulation"""
+    global activeProfiler, lastProfiler
+    activeProfiler = Profiler()
+    lastProfiler = activeProfiler
+    return activeProfiler
+
+
+def stop():
+    global activeProfiler
+    activeProfiler = None
+
+
+def register():
+    bpy.utils.register_class(SCENE_OT_cm_profiler_export)
+
+
+def unregister():
+    bpy.utils.unregister_class(SCENE_OT_cm_profiler_export)
@@ -18,6 +18,7 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import code
+import traceback
 
 
 class Interpreter(code.InteractiveConsole):
@@ -47,3 +48,52 @@ class Interpreter(code.InteractiveConsole):
             return self.locals["output"]
         else:
             print("Script must have out output")
+
+
+class UserCode:
+    """The code of an Input or Python node compiled once when the brain is
+    compiled. Errors are only printed the first time they happen so that a
+    broken node doesn't print for every agent on every frame"""
+    def __init__(self, source, mode, name):
+        """:param mode: "eval" for an expression or "exec" for a script that
+                        sets output"""
+        self.mode = mode
+        self.name = name
+        self.reported = False
+        try:
+            self.code = compile(Interpreter.preprocess(source),
+                                "<CrowdMaster node {}>".format(name), mode)
+        except SyntaxError:
+            self.code = None
+            self.report()
+
+    def report(self, message=None):
+        """Print the current exception (or message) if nothing has been
+        printed for this node yet"""
+        if self.reported:
+            return
+        self.reported = True
+        print("Error in the code of node", self.name)
+        if message is None:
+            traceback.print_exc()
+        else:
+            print(message)
+
+    def run(self, namespace):
+        """Run the code with namespace as its variables
+
+        :returns: the value of the expression or the output of the script
+                  (None if there was an error)"""
+        if self.code is None:
+            return None
+        try:
+            if self.mode == "eval":
+                return eval(self.code, namespace)
+            namespace.pop("output", None)
+            exec(self.code, namespace)
+        except Exception:
+            self.report()
+            return None
+        if "output" in namespace:
+            return namespace["output"]
+        self.report("Script must have an output")
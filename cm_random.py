@@ -0,0 +1,53 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""Counter based random numbers for the brains.
+
+Each number is a hash of what it is for (the seed of the simulation, the
+slot of the agent, the frame, the node and how many numbers the node has
+already asked for this frame) instead of the next value of a global
+generator. This means nothing has to be seeded, the numbers don't depend on
+the order the agents are evaluated in and they are the same in every
+process and every session (unlike hash of a str)"""
+
+import zlib
+
+MASK = 2**64 - 1
+
+
+def mix(z):
+    """The splitmix64 finaliser"""
+    z = (z + 0x9E3779B97F4A7C15) & MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK
+    return z ^ (z >> 31)
+
+
+def randomKey(name):
+    """The int used to identify a node (or anything else with a name)"""
+    return zlib.crc32(name.encode("utf-8"))
+
+
+def counterRandom(seed, *counters):
+    """A float in the range [0, 1) that is always the same for the same
+    seed and counters (ints)"""
+    z = mix(seed & MASK)
+    for c in counters:
+        z = mix(z ^ (c & MASK))
+    return (z >> 11) * (1.0 / 2**53)
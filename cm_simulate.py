@@ -20,11 +20,33 @@
 import bpy
 
 import time
+import os
+import gzip
+import pickle
 
 from . import cm_channels as chan
+from . import cm_parallel
+from . import cm_profiler
+from .cm_profiler import section
 
 from .cm_agent import Agent
+from .cm_agentStore import AgentStore, FLOATCOLUMNS, FLAGCOLUMNS, INTCOLUMNS
+from array import array
 from .cm_actions import getmotions
+from .cm_snapshots import SnapshotCache
+from .cm_lod import LODScheduler
+from .cm_keyframes import KeyframeWriter
+from .cm_trajectory import TrajectoryWriter
+from .cm_nla import placeStrip
+from .cm_brainVector import VectorEngine
+from .cm_telemetry import recordedAgents
+
+
+def checkpointPath(frame):
+    """Where the checkpoint for frame is saved"""
+    preferences = bpy.context.user_preferences.addons[__package__].preferences
+    directory = bpy.path.abspath(preferences.checkpoint_path)
+    return os.path.join(directory, "checkpoint_{:06d}.cmcp".format(frame))
 
 
 class Simulation:
@@ -32,8 +54,9 @@ class Simulation:
     def __init__(self):
         preferences = bpy.context.user_preferences.addons[__package__].preferences
         self.agents = {}
+        self.store = AgentStore()
         self.framelast = 1
-        self.compbrains = {}
+        self.compbrains = {}  # {node group name: BrainProgram}
         Noise = chan.Noise(self)
         Sound = chan.Sound(self)
         State = chan.State(self)
@@ -50,33 +73,228 @@ class Simulation:
                       "Ground": Ground,
                       "Formation": Formation,
                       "Path": Path}
+        self.tagIndex = {}
+        """Each distinct tag string resolved to the channels it registers
+        with. {tag: [(channel, suffix), ...]}"""
+        self.registrations = []
+        """Registrations collected while this frame is evaluated that are
+        given to the channels for the next frame"""
         if preferences.show_debug_options:
             self.totalTime = 0
             self.totalFrames = 0
+        if preferences.use_profiler:
+            cm_profiler.start()
+        else:
+            cm_profiler.stop()
 
         self.actions = {}
         self.actionGroups = {}
 
+        self.keyframes = KeyframeWriter(self.store)
+        self.vectorEngine = None
+        if preferences.brain_engine == "VECTOR":
+            self.vectorEngine = VectorEngine(self)
+        self.trajectory = None  # Created on the first frame if enabled
+
+        self.randomSeed = preferences.random_seed  # See cm_random
+
+        self.recording = frozenset()  # Agents to record the telemetry of
+        self.recordFrame = 0
+        self.telemetryFrames = preferences.telemetry_frames
+
+        self.lod = None
+        if preferences.use_lod:
+            self.lod = LODScheduler(self.store, preferences.lod_near,
+                                    preferences.lod_far,
+                                    preferences.lod_max_interval)
+
+        self.snapshots = None
+        if preferences.use_snapshot_cache:
+            self.snapshots = SnapshotCache(preferences.snapshot_budget * 2**20)
+
+        self.isWorker = False  # True in the processes forked by cm_parallel
+        self.deferredActions = []  # Actions placed while in a worker
+
     def setupActions(self):
         """Set up the actions"""
         self.actions, self.actionGroups = getmotions()
 
-    def newagent(self, name, brain):
+    def newagent(self, name, brain, clear=True):
         """Set up an agent"""
         nGps = bpy.data.node_groups
         preferences = bpy.context.user_preferences.addons[__package__].preferences
         if brain in nGps and nGps[brain].bl_idname == "CrowdMasterTreeType":
-            ag = Agent(name, nGps[brain], self)
+            ag = Agent(name, nGps[brain], self, clear)
             self.agents[name] = ag
         else:
             if preferences.show_debug_options:
                 print("No such brain type:" + brain)
 
-    def createAgents(self, group):
-        """Set up all the agents at the beginning of the simulation"""
+    def createAgents(self, group, clear=True):
+        """Set up all the agents at the beginning of the simulation
+
+        :param clear: remove the agents existing animation (False when the
+                      simulation is going to be resumed from a checkpoint)"""
+        total = sum(len(ty.agents) for ty in group.agentTypes)
+        self.store.reserve(total)
         for ty in group.agentTypes:
             for ag in ty.agents:
-                self.newagent(ag.name, ty.name)
+                self.newagent(ag.name, ty.name, clear)
+
+    def getState(self):
+        """Everything needed to continue the simulation from this frame"""
+        store = self.store
+        columns = {}
+        for col in FLOATCOLUMNS + FLAGCOLUMNS + INTCOLUMNS:
+            columns[col] = getattr(store, col).tobytes()
+        return {"framelast": self.framelast,
+                "names": store.names[:len(store)],
+                "columns": columns,
+                "agents": {n: a.getState() for n, a in self.agents.items()},
+                "channels": {n: ch.getState() for n, ch in self.lvars.items()},
+                "randomSeed": self.randomSeed}
+
+    def setState(self, state):
+        """Restore the values returned by getState. The agents are matched
+        by name so the simulation must have been set up with createAgents"""
+        store = self.store
+        self.framelast = state["framelast"]
+        for col, data in state["columns"].items():
+            saved = array(getattr(store, col).typecode)
+            saved.frombytes(data)
+            current = getattr(store, col)
+            for oldSlot, name in enumerate(state["names"]):
+                if name in store.slots:
+                    current[store.slots[name]] = saved[oldSlot]
+        for name, agentState in state["agents"].items():
+            if name in self.agents:
+                self.agents[name].setState(agentState)
+        # Keep the seed the state was made with even if the preference changed
+        self.randomSeed = state["randomSeed"]
+
+        # The state of the channels is their state after newframe
+        for chan in self.lvars.values():
+            chan.newframe()
+        for name, chanState in state["channels"].items():
+            if chanState is not None:
+                self.lvars[name].setState(chanState)
+        self.registrations = []
+        for a in self.agents.values():
+            self.registerTags(a, a.access["tags"])
+        self.flushRegistrations()
+
+    def saveCheckpoint(self, filepath):
+        """Write the state of the simulation to a compressed file"""
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.keyframes.flush()
+        with gzip.open(filepath, "wb") as f:
+            pickle.dump(self.getState(), f, pickle.HIGHEST_PROTOCOL)
+
+    def loadCheckpoint(self, filepath):
+        """Continue the simulation from a file written by saveCheckpoint.
+        Anything animated after the checkpoint is removed"""
+        with gzip.open(filepath, "rb") as f:
+            state = pickle.load(f)
+        self.setState(state)
+        self.keyframes.discardAfter(self.framelast)
+        for a in self.agents.values():
+            a.truncateAnimation(self.framelast)
+
+    def placeAction(self, agentid, actionName):
+        """Start playing an action on an agent from the current frame"""
+        if self.isWorker:
+            # Changes to bpy data in a worker process would be lost
+            self.deferredActions.append((agentid, actionName))
+            return
+        if self.trajectory is not None:
+            self.trajectory.addTransition(bpy.context.scene.frame_current,
+                                          agentid, "action", actionName)
+        actionobj = self.actions[actionName]  # from .cm_motion.py
+        obj = bpy.context.scene.objects[agentid]  # bpy object
+
+        action = actionobj.action  # bpy action
+        if action:
+            placeStrip(obj, action, bpy.context.scene.frame_current)
+
+    def resolveTag(self, tag):
+        """Work out which channels a tag should be registered with. Only done
+        the first time each tag string is seen"""
+        if tag not in self.tagIndex:
+            resolved = []
+            for channel in self.lvars:
+                if tag[:len(channel)] == channel:
+                    resolved.append((self.lvars[channel], tag[len(channel):]))
+            self.tagIndex[tag] = resolved
+        return self.tagIndex[tag]
+
+    def registerTags(self, agent, tags):
+        """Queue the channel registrations for an agents tags. Called
+        straight after the agents brain has been evaluated"""
+        for tag, val in tags.items():
+            if tag in self.tagIndex:
+                resolved = self.tagIndex[tag]
+            else:
+                resolved = self.resolveTag(tag)
+            for channel, suffix in resolved:
+                self.registrations.append((channel, agent, suffix, val))
+
+    def flushRegistrations(self):
+        """Give the queued registrations to the channels. Called after the
+        channels have been cleared for the new frame"""
+        for channel, agent, suffix, val in self.registrations:
+            channel.register(agent, suffix, val)
+        self.registrations = []
+
+    def recordTrajectory(self, frame):
+        """Add the current positions of the agents to the trajectory cache"""
+        store = self.store
+        names = store.names[:len(store)]
+        states = [self.agents[n].brain.currentState for n in names]
+        self.trajectory.record(frame, store, states)
+
+    def thinkVector(self, thinking):
+        """Evaluate the brains with the vector engine (see cm_brainVector)"""
+        self.vectorEngine.think(thinking.values())
+        active = bpy.context.active_object
+        for a in self.agents.values():
+            if a.id in thinking:
+                if active is not None and active.name == a.id:
+                    a.brain.hightLight(bpy.context.scene.frame_current)
+                a.readBrain()
+            self.registerTags(a, a.external["tags"])
+
+    def thinkParallel(self, processes, thinking):
+        """Evaluate the brains of the agents using several processes. The
+        active agent and the agents that telemetry is recorded for are always
+        evaluated here so that their nodes can be highlighted"""
+        active = bpy.context.active_object
+        activeName = None
+        if active is not None and active.name in thinking:
+            activeName = active.name
+        names = [n for n in thinking
+                 if n != activeName and n not in self.recording]
+
+        results, actions, channels = cm_parallel.evaluate(self, names,
+                                                          processes)
+        for name, state in results:
+            agent = self.agents[name]
+            agent.brain.setState(state)
+            agent.readBrain()
+        for chanStates in channels:
+            for chanName, state in chanStates.items():
+                if state is not None:
+                    self.lvars[chanName].mergeWorkerState(state)
+        for agentid, actionName in actions:
+            self.placeAction(agentid, actionName)
+
+        for name in thinking:
+            if name == activeName or name in self.recording:
+                self.agents[name].think()
+
+        for a in self.agents.values():
+            self.registerTags(a, a.external["tags"])
 
     def step(self, scene):
         """Called when the next frame is moved to"""
@@ -84,20 +302,71 @@ class Simulation:
         if preferences.show_debug_options:
             t = time.time()
             print("NEWFRAME", bpy.context.scene.frame_current)
-        for agent in self.agents.values():
-            for tag in agent.access["tags"]:
-                for channel in self.lvars:
-                    if tag[:len(channel)] == channel:
-                        self.lvars[channel].register(agent, tag[len(channel):],
-                                                     agent.access["tags"][tag])
-        # TODO registering channels would be much more efficient if done
-        # straight after the agent is evaluated.
-        for a in self.agents.values():
-            a.step()
-        for a in self.agents.values():
-            a.apply()
-        for chan in self.lvars.values():
-            chan.newframe()
+        if cm_profiler.activeProfiler is not None:
+            cm_profiler.activeProfiler.newFrame(bpy.context.scene.frame_current)
+        processes = preferences.sim_processes
+        frame = bpy.context.scene.frame_current
+        if self.lod is not None:
+            with section("simulation", "LODScheduler.update"):
+                self.lod.update(bpy.context.scene)
+                active = bpy.context.active_object
+                thinking = {n: a for n, a in self.agents.items()
+                            if self.lod.due(a.slot, frame) or
+                            (active is not None and active.name == n)}
+                for a in self.agents.values():
+                    if a.id not in thinking:
+                        a.skip()
+        else:
+            thinking = self.agents
+        self.recording = recordedAgents(preferences.telemetry_mode,
+                                        self.agents)
+        self.recordFrame = frame
+        if self.trajectory is None and preferences.use_trajectory_cache:
+            directory = bpy.path.abspath(preferences.trajectory_path)
+            self.trajectory = TrajectoryWriter(directory,
+                                               self.store.names[:len(self.store)],
+                                               frame - 1,
+                                               preferences.trajectory_chunk_size)
+            self.recordTrajectory(frame - 1)
+        with section("simulation", "Simulation.sync"):
+            for a in self.agents.values():
+                a.sync()
+        with section("simulation", "Simulation.think"):
+            if self.vectorEngine is not None:
+                self.thinkVector(thinking)
+            elif processes > 1 and len(thinking) > 1 and cm_parallel.canFork():
+                self.thinkParallel(processes, thinking)
+            else:
+                for a in self.agents.values():
+                    if a.id in thinking:
+                        a.think()
+                    self.registerTags(a, a.external["tags"])
+        with section("simulation", "Simulation.move"):
+            for a in self.agents.values():
+                if a.id in thinking:
+                    a.move()
+                else:
+                    a.extrapolate()
+        with section("simulation", "Simulation.apply"):
+            for a in self.agents.values():
+                a.apply()
+        with section("simulation", "Simulation.newframe"):
+            for chan in self.lvars.values():
+                chan.newframe()
+            self.flushRegistrations()
+        if self.trajectory is not None:
+            with section("simulation", "Simulation.recordTrajectory"):
+                self.recordTrajectory(frame)
+        flushInterval = preferences.keyframe_flush_interval
+        if flushInterval > 0 and frame % flushInterval == 0:
+            self.keyframes.flush()
+        if self.snapshots is not None:
+            with section("simulation", "Simulation.snapshot"):
+                self.snapshots.add(frame, self.getState())
+        interval = preferences.checkpoint_interval
+        if interval > 0 and frame % interval == 0:
+            with section("simulation", "Simulation.saveCheckpoint"):
+                self.saveCheckpoint(checkpointPath(frame))
         if preferences.show_debug_options:
             newT = time.time()
             print("time", newT - t)
@@ -105,11 +374,71 @@ class Simulation:
             self.totalFrames += 1
             print("spf", self.totalTime/self.totalFrames)  # seconds per frame
 
+    def run(self, frameStart, frameEnd):
+        """Simulate every frame from frameStart to frameEnd in a single loop
+        without going through frame_change_pre or redrawing the interface
+
+        :returns: frames simulated per second
+        :rtype: float"""
+        preferences = bpy.context.user_preferences.addons[__package__].preferences
+        scene = bpy.context.scene
+        self.stopFrameHandler()
+        self.framelast = frameStart
+        scene.frame_set(frameStart)
+        startT = time.time()
+        for frame in range(frameStart + 1, frameEnd + 1):
+            scene.frame_set(frame)
+            self.framelast = frame
+            self.step(scene)
+        self.keyframes.flush()
+        if self.trajectory is not None:
+            self.trajectory.flush()
+        endT = time.time()
+        frames = frameEnd - frameStart
+        if endT - startT == 0 or frames <= 0:
+            return 0
+        fps = frames / (endT - startT)
+        if preferences.show_debug_options:
+            print("Simulated", frames, "frames at", fps, "frames per second")
+        return fps
+
+    def rewind(self, frame):
+        """Go back to the latest snapshot at or before frame and remove
+        everything that was simulated after it
+
+        :returns: True if there was a snapshot to go back to"""
+        snapFrame = self.snapshots.nearest(frame)
+        if snapFrame is None:
+            return False
+        self.setState(self.snapshots.get(snapFrame))
+        self.snapshots.discardAfter(snapFrame)
+        self.keyframes.discardAfter(snapFrame)
+        if self.trajectory is not None:
+            self.trajectory.truncate(snapFrame)
+        for a in self.agents.values():
+            a.truncateAnimation(snapFrame)
+        return True
+
+    def jumpTo(self, frame, scene):
+        """Bring the simulation to frame when the playhead has moved
+        somewhere other than the next frame. When moving backwards the
+        simulation is re-simulated forwards from the nearest snapshot"""
+        if frame <= self.framelast:
+            if not self.rewind(frame - 1):
+                return
+        for f in range(self.framelast + 1, frame + 1):
+            scene.frame_current = f
+            self.framelast = f
+            self.step(scene)
+
     def frameChangeHandler(self, scene):
         """Given to Blender to call whenever the scene moves to a new frame"""
         if self.framelast+1 == bpy.context.scene.frame_current:
             self.framelast = bpy.context.scene.frame_current
             self.step(scene)
+        elif self.snapshots is not None:
+            if self.framelast != bpy.context.scene.frame_current:
+                self.jumpTo(bpy.context.scene.frame_current, scene)
 
     def frameChangeHighlight(self, scene):
         """Not unregistered when simulation stopped"""
@@ -125,6 +454,8 @@ class Simulation:
             self.totalTime = 0
             self.totalFrames = 0
             print("Registering frame change handler")
+        if self.snapshots is not None and self.framelast not in self.snapshots:
+            self.snapshots.add(self.framelast, self.getState())
         if self.frameChangeHandler in bpy.app.handlers.frame_change_pre:
             bpy.app.handlers.frame_change_pre.remove(self.frameChangeHandler)
         bpy.app.handlers.frame_change_pre.append(self.frameChangeHandler)
@@ -132,8 +463,12 @@ class Simulation:
             bpy.app.handlers.frame_change_post.append(self.frameChangeHighlight)
 
     def stopFrameHandler(self):
-        """Remove self.frameChangeHandler from Blenders event handlers"""
+        """Remove self.frameChangeHandler from Blenders event handlers and
+        write any keyframes that are still waiting"""
         preferences = bpy.context.user_preferences.addons[__package__].preferences
+        self.keyframes.flush()
+        if self.trajectory is not None:
+            self.trajectory.flush()
         if self.frameChangeHandler in bpy.app.handlers.frame_change_pre:
             if preferences.show_debug_options:
                 print("Unregistering frame change handler")
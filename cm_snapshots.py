@@ -0,0 +1,78 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import pickle
+import zlib
+
+
+class SnapshotCache:
+    """Compressed copies of the simulation state (see Simulation.getState)
+    for the frames that have been simulated. When the memory budget is used
+    up the snapshots furthest from the playhead are thrown away first"""
+    def __init__(self, budget):
+        """
+        :param budget: the maximum total size of the snapshots in bytes
+        :type budget: int"""
+        self.budget = budget
+        self.snapshots = {}  # {frame: bytes}
+        self.size = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __contains__(self, frame):
+        return frame in self.snapshots
+
+    def add(self, frame, state, playhead=None):
+        """Store the state of the simulation at the end of frame"""
+        data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+        self.remove(frame)
+        self.snapshots[frame] = data
+        self.size += len(data)
+        self.evict(frame if playhead is None else playhead)
+
+    def remove(self, frame):
+        if frame in self.snapshots:
+            self.size -= len(self.snapshots[frame])
+            del self.snapshots[frame]
+
+    def evict(self, playhead):
+        """Remove the snapshots furthest from the playhead until the cache
+        fits in the budget. The closest snapshot is always kept"""
+        while self.size > self.budget and len(self.snapshots) > 1:
+            furthest = max(self.snapshots, key=lambda f: abs(f - playhead))
+            self.remove(furthest)
+
+    def nearest(self, frame):
+        """The latest frame at or before frame that has a snapshot
+
+        :rtype: int | None"""
+        before = [f for f in self.snapshots if f <= frame]
+        if before:
+            return max(before)
+        return None
+
+    def get(self, frame):
+        return pickle.loads(zlib.decompress(self.snapshots[frame]))
+
+    def discardAfter(self, frame):
+        """Forget the snapshots after frame. Used when the simulation is
+        rewound since they will be simulated again"""
+        for f in [f for f in self.snapshots if f > frame]:
+            self.remove(f)
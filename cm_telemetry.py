@@ -0,0 +1,98 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+import bpy
+
+
+class Telemetry:
+    """The results of the nodes of one brain for the last size frames that
+    were recorded. Only the raw results are kept, the colours shown on the
+    nodes are worked out when they are displayed"""
+    def __init__(self, size):
+        self.size = size
+        self.frames = [None] * size  # The frame held in each position
+        self.records = [None] * size  # type: List[Dict[Neuron | State, ...]]
+        self.current = {}
+
+    def newFrame(self, frame):
+        """Start recording frame, replacing the oldest frame held"""
+        i = frame % self.size
+        self.frames[i] = frame
+        self.current = self.records[i] = {}
+
+    def record(self, node, value):
+        self.current[node] = value
+
+    def get(self, frame, node):
+        """The value recorded for node on frame or None if there isn't one"""
+        i = frame % self.size
+        if self.frames[i] != frame:
+            return None
+        return self.records[i].get(node)
+
+
+def recordedAgents(mode, agents):
+    """The names of the agents to record the telemetry of this frame
+
+    :param mode: the telemetry_mode preference"""
+    if mode == "NONE":
+        return frozenset()
+    if mode == "ALL":
+        return frozenset(agents)
+    names = set()
+    active = bpy.context.active_object
+    if active is not None:
+        names.add(active.name)
+    if mode == "SELECTED":
+        names.update(obj.name for obj in bpy.context.selected_objects)
+    return frozenset(n for n in names if n in agents)
+
+
+def outputColour(output):
+    """The colour (hue, sat, val) of a neuron with this output"""
+    if not output:
+        return 0, 0, 0.5
+    av = sum(output.values()) / len(output)
+    if av > 0:
+        startHue = 0.333
+    else:
+        startHue = 0.5
+
+    if av > 1:
+        hueChange = -(-(abs(av)+1)/abs(av) + 2) * (1/3)
+        hue = 0.333 + hueChange
+    elif av < -1:
+        hueChange = (-(abs(av)+1)/abs(av) + 2) * (1/3)
+        hue = 0.5 + hueChange
+    else:
+        hue = startHue
+
+    if abs(av) < 1:
+        sat = abs(av)**(1/2)
+    else:
+        sat = 1
+    return hue, sat, 1
+
+
+def stateColour(complete):
+    """The colour (hue, sat, val) of a state that is complete of the way
+    through (None if it wasn't the current state)"""
+    if complete is None:
+        return 0.0, 0.0, 1.0
+    return 0.15, 0.4, complete
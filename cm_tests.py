@@ -20,6 +20,13 @@
 import unittest
 import bpy
 
+from .cm_compileBrain import compileProgram
+from .cm_impulse import ImpulseContainer, SingleImpulse, toImpulse
+from .cm_keyframes import reduceKeyframes
+from .cm_random import counterRandom, randomKey
+from .cm_simulate import Simulation
+from .cm_channels.cm_formationChannels import Channel as FormationChannel
+
 
 class AddonRegisterTestCase(unittest.TestCase):
     def setUp(self):
@@ -35,6 +42,10 @@ class AddonRegisterTestCase(unittest.TestCase):
         bpy.ops.scene.cm_start()
         bpy.ops.scene.cm_stop()
 
+    def testBatchSimulate(self):
+        result = bpy.ops.scene.cm_batch_simulate(frameStart=1, frameEnd=3)
+        self.assertIn('FINISHED', result)
+
     def testRegistered(self):
         sceneProps = ["cm_actions", "cm_events", "cm_groups",
                       "cm_groups_index", "cm_manual",
@@ -44,23 +55,183 @@ class AddonRegisterTestCase(unittest.TestCase):
 
         opsProps = ["cm_actions_populate", "cm_actions_remove", "cm_agent_add",
                     "cm_agent_add_selected", "cm_agent_nodes_generate",
-                    "cm_agents_move", "cm_convert_to_bound_box",
+                    "cm_agents_move", "cm_bake_trajectories",
+                    "cm_batch_simulate", "cm_brain_source",
+                    "cm_consolidate_nla", "cm_convert_to_bound_box",
                     "cm_events_move", "cm_events_populate", "cm_events_remove",
                     "cm_gennodes_pos_formation_simple",
                     "cm_gennodes_pos_random_simple",
                     "cm_gennodes_pos_target_simple", "cm_groups_reset",
                     "cm_paths_populate", "cm_paths_remove",
-                    "cm_place_deferred_geo", "cm_run_long_tests",
+                    "cm_playback_start", "cm_playback_stop",
+                    "cm_place_deferred_geo", "cm_profiler_export",
+                    "cm_reduce_keyframes",
+                    "cm_resume", "cm_run_long_tests",
                     "cm_run_short_tests", "cm_save_prefs", "cm_setup_agent",
                     "cm_setup_sample_nodes", "cm_simnodes_action_random",
                     "cm_simnodes_mov_simple", "cm_start", "cm_stop"]
         for op in opsProps:
             self.assertIn(op, dir(bpy.ops.scene))
 
+
+class KeyframeReductionTestCase(unittest.TestCase):
+    def testStraightLine(self):
+        co = []
+        for f in range(1, 11):
+            co += [f, f * 0.5]
+        self.assertEqual(reduceKeyframes(co, 0.001), [0, 9])
+
+    def testWithinTolerance(self):
+        co = [1, 0.0, 2, 1.0, 3, 0.0, 4, 0.0005, 5, 0.0]
+        kept = reduceKeyframes(co, 0.001)
+        self.assertEqual(kept, [0, 1, 2, 4])
+        for i in range(len(co) // 2):
+            if i not in kept:
+                before = max(k for k in kept if k < i)
+                after = min(k for k in kept if k > i)
+                x0, y0 = co[before * 2], co[before * 2 + 1]
+                x1, y1 = co[after * 2], co[after * 2 + 1]
+                y = y0 + (y1 - y0) * (co[i * 2] - x0) / (x1 - x0)
+                self.assertLessEqual(abs(co[i * 2 + 1] - y), 0.001)
+
+    def testShortCurves(self):
+        self.assertEqual(reduceKeyframes([], 0.1), [])
+        self.assertEqual(reduceKeyframes([1, 0.0, 2, 5.0], 0.1), [0, 1])
+
+
+class ImpulseTestCase(unittest.TestCase):
+    def testSingle(self):
+        imp = toImpulse(0.5)
+        self.assertIsInstance(imp, SingleImpulse)
+        self.assertEqual(imp, {"None": 0.5})
+        self.assertEqual(toImpulse({"None": 2}), {"None": 2})
+        self.assertEqual(imp.map(lambda v: v * 2), {"None": 1.0})
+
+    def testContainer(self):
+        imp = toImpulse({"agent1": 1, "agent2": 0.25})
+        self.assertIsInstance(imp, ImpulseContainer)
+        self.assertEqual(imp["agent2"], 0.25)
+        self.assertNotIn("agent3", imp)
+        self.assertEqual(dict(imp.map(lambda v: v + 1)),
+                         {"agent1": 2.0, "agent2": 1.25})
+
+    def testNotNumbers(self):
+        self.assertEqual(toImpulse({"None": "text"}), {"None": "text"})
+        self.assertEqual(toImpulse({"a": None}), {"a": None})
+        self.assertIsNone(toImpulse(None))
+
+
+class BrainCompileTestCase(unittest.TestCase):
+    class Sim:
+        lvars = {}
+
+    def setUp(self):
+        self.tree = bpy.data.node_groups.new("CrowdMaster Test Brain",
+                                             "CrowdMasterTreeType")
+
+    def tearDown(self):
+        bpy.data.node_groups.remove(self.tree)
+
+    def testActionStates(self):
+        nodes = self.tree.nodes
+        start = nodes.new("StartState")
+        action = nodes.new("ActionState")
+        action.stateLength = 12
+        action.cycleState = True
+        action.actionName = "walk"
+        group = nodes.new("ActionGroupState")
+        group.cycleState = True
+        self.tree.links.new(start.outputs["To"], action.inputs["From"])
+        self.tree.links.new(action.outputs["To"], group.inputs["From"])
+
+        program = compileProgram(self.tree)
+        self.assertEqual(program.startState, start.name)
+        brain = program.instantiate(self.Sim(), "agent")
+        state = brain.neurons[action.name]
+        self.assertEqual(state.length, 12)
+        self.assertTrue(state.cycleState)
+        self.assertEqual(state.actionName, "walk")
+        self.assertEqual(state.outputs, [group.name])
+        self.assertTrue(brain.neurons[group.name].cycleState)
+
+    def testGuardedInputs(self):
+        """The inputs of a neuron that is dependant on a state are only run
+        while that state is current (unless something else uses them)"""
+        nodes = self.tree.nodes
+        start = nodes.new("StartState")
+        action = nodes.new("ActionState")
+        tag = nodes.new("SetTagNode")
+        output = nodes.new("OutputNode")
+        self.tree.links.new(start.outputs["To"], action.inputs["From"])
+        self.tree.links.new(tag.outputs["Output"], output.inputs["Input"])
+        self.tree.links.new(output.outputs["Dependant"],
+                            action.inputs["Dependant"])
+
+        program = compileProgram(self.tree)
+        self.assertNotIn(tag.name, program.statePlans[None])
+        self.assertNotIn(tag.name, program.statePlans[start.name])
+        self.assertEqual(program.statePlans[action.name],
+                         [tag.name, output.name])
+
+
+class CounterRandomTestCase(unittest.TestCase):
+    def testRepeatable(self):
+        self.assertEqual(counterRandom(0, 3, 10, randomKey("Noise"), 0),
+                         counterRandom(0, 3, 10, randomKey("Noise"), 0))
+        self.assertEqual(randomKey("Noise"), 1013496109)
+
+    def testCounters(self):
+        values = {counterRandom(0, slot, frame)
+                  for slot in range(20) for frame in range(20)}
+        self.assertEqual(len(values), 400)
+        for v in values:
+            self.assertGreaterEqual(v, 0)
+            self.assertLess(v, 1)
+
+
+class SimulationStateTestCase(unittest.TestCase):
+    def makeSim(self):
+        sim = Simulation()
+        form = sim.lvars["Formation"]
+        form.formations["Targets"] = FormationChannel("Targets", sim)
+        return sim, form.formations["Targets"]
+
+    def step(self, sim, users):
+        ch = sim.lvars["Formation"].formations["Targets"]
+        ch.inpBuffer = list(users)
+        for chan in sim.lvars.values():
+            chan.newframe()
+
+    def testFormationRoundTrip(self):
+        """Restoring a state and simulating a frame gives the same result
+        as simulating the frame without stopping"""
+        sim, ch = self.makeSim()
+        self.step(sim, ["b", "c", "a"])
+        ch.lastCalcd = ({"b"}, {(0.0, 1.0, 0.0)}, {"b": (0.0, 1.0, 0.0)})
+        state = sim.getState()
+
+        resumed, resumedCh = self.makeSim()
+        resumed.setState(state)
+        self.assertEqual(resumedCh.priority, ["b", "c", "a"])
+        self.assertEqual(resumedCh.lastCalcd[:2], ch.lastCalcd[:2])
+        self.assertEqual(tuple(resumedCh.lastCalcd[2]["b"]),
+                         ch.lastCalcd[2]["b"])
+
+        self.step(sim, ["a", "d", "b"])
+        self.step(resumed, ["a", "d", "b"])
+        self.assertEqual(resumedCh.priority, ch.priority)
+        self.assertEqual(resumedCh.priority, ["b", "a", "d"])
+
+
 def createShortTestSuite():
     """Gather all the short tests from this module in a test suite"""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(AddonRegisterTestCase))
+    test_suite.addTest(unittest.makeSuite(KeyframeReductionTestCase))
+    test_suite.addTest(unittest.makeSuite(ImpulseTestCase))
+    test_suite.addTest(unittest.makeSuite(BrainCompileTestCase))
+    test_suite.addTest(unittest.makeSuite(CounterRandomTestCase))
+    test_suite.addTest(unittest.makeSuite(SimulationStateTestCase))
     return test_suite
 
 def createLongTestSuite():
@@ -0,0 +1,347 @@
+# Copyright 2016 CrowdMaster Developer Team
+#
+# ##### BEGIN GPL LICENSE BLOCK ######
+# This file is part of CrowdMaster.
+#
+# CrowdMaster is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CrowdMaster is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CrowdMaster.  If not, see <http://www.gnu.org/licenses/>.
+# ##### END GPL LICENSE BLOCK #####
+
+"""A cache of the agents trajectories that can be read without Blender.
+
+The cache is a directory containing index.json and one file per chunk of
+frames. Each chunk file holds a float32 block of shape
+(frames, agents, len(COLUMNS)) followed by an int32 block of shape
+(frames, agents) with the id of each agents current state. Both are stored
+in the byte order given in the index so a chunk can be memory mapped and
+read directly. The state changes and actions started during a chunk are
+kept next to it in a json file of their own so nothing that has already
+been written has to be written again.
+
+The files are written by a background thread so that the simulation doesn't
+wait for the disk. At most maxQueued chunks are waiting to be written at
+any time so the memory used doesn't grow with the length of the shot"""
+
+import json
+import mmap
+import os
+import queue
+import sys
+import threading
+from array import array
+
+COLUMNS = ("apx", "apy", "apz", "arx", "ary", "arz")
+VERSION = 2
+
+
+def chunkName(start):
+    return "chunk_{:06d}.bin".format(start)
+
+
+def transitionsName(start):
+    return "transitions_{:06d}.json".format(start)
+
+
+class TrajectoryWriter:
+    """Records the agents every frame and writes them to the cache a chunk
+    at a time"""
+    def __init__(self, directory, names, frameStart, chunkSize=100,
+                 maxQueued=2):
+        """
+        :param names: the agents in the order of their slots in the store
+        :param frameStart: the first frame that will be recorded
+        :param maxQueued: chunks waiting to be written before record blocks"""
+        self.directory = directory
+        self.names = list(names)
+        self.agentIndex = {n: i for i, n in enumerate(self.names)}
+        self.frameStart = frameStart
+        self.chunkSize = max(int(chunkSize), 1)
+        self.chunks = []  # [(start, end)] of the chunks written
+        self.chunkStart = frameStart
+        self.frames = 0  # frames in the current chunk
+        self.values = array('f')
+        self.states = array('i')
+        self.stateIds = {None: -1}
+        self.stateNames = []
+        self.transitions = []  # [(frame, agent index, kind, name)] this chunk
+        self.lastStates = [None] * len(self.names)
+        self.queue = queue.Queue(maxQueued + 1)  # + 1 for the index
+        self.thread = None
+        self.error = None  # Raised by the next call after a write fails
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def work(self):
+        """Run by the background thread. Writes files until given None"""
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            path, data = job
+            try:
+                with open(path, "wb" if isinstance(data, tuple) else "w") as f:
+                    if isinstance(data, tuple):
+                        for block in data:
+                            block.tofile(f)
+                    else:
+                        f.write(data)
+            except OSError as e:
+                self.error = e
+
+    def put(self, path, data):
+        """Give a file to the background thread to write. Blocks while the
+        queue is full"""
+        if self.error is not None:
+            self.raiseError()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work,
+                                           name="CrowdMaster trajectory writer")
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put((path, data))
+
+    def wait(self):
+        """Wait until every queued file has been written"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            self.raiseError()
+
+    def raiseError(self):
+        error = self.error
+        self.error = None
+        raise error
+
+    def stateId(self, name):
+        """The id of a state in the int32 block of the chunks"""
+        if name not in self.stateIds:
+            self.stateIds[name] = len(self.stateNames)
+            self.stateNames.append(name)
+        return self.stateIds[name]
+
+    def record(self, frame, store, states):
+        """Add a frame to the cache. Frames must be recorded in order
+
+        :param states: the name of each agents current state in slot order"""
+        if frame != self.chunkStart + self.frames:
+            raise ValueError("Frame {} recorded out of order".format(frame))
+        count = len(self.names)
+        columns = [getattr(store, col) for col in COLUMNS]
+        values = self.values
+        for slot in range(count):
+            for col in columns:
+                values.append(col[slot])
+        for i, name in enumerate(states):
+            self.states.append(self.stateId(name))
+            if name != self.lastStates[i]:
+                self.transitions.append((frame, i, "state", name))
+                self.lastStates[i] = name
+        self.frames += 1
+        if self.frames == self.chunkSize:
+            self.writeChunk()
+            self.chunks.append((self.chunkStart, frame))
+            self.chunkStart = frame + 1
+            self.frames = 0
+            self.values = array('f')
+            self.states = array('i')
+            self.transitions = []
+            self.writeIndex()
+
+    def addTransition(self, frame, name, kind, value):
+        """Note that an agent changed state or started an action"""
+        i = self.agentIndex.get(name)
+        if i is not None:
+            self.transitions.append((frame, i, kind, value))
+
+    def writeChunk(self):
+        """Queue the current chunk and its transitions to be written. The
+        arrays must not be changed afterwards so copies are given while the
+        chunk is unfinished"""
+        path = os.path.join(self.directory, chunkName(self.chunkStart))
+        if self.frames == self.chunkSize:
+            self.put(path, (self.values, self.states))
+        else:
+            self.put(path, (array('f', self.values), array('i', self.states)))
+        self.put(os.path.join(self.directory, transitionsName(self.chunkStart)),
+                 json.dumps([{"frame": f, "agent": a, "kind": k, "name": n}
+                             for f, a, k, n in self.transitions]))
+
+    def writeIndex(self):
+        chunks = list(self.chunks)
+        if self.frames > 0:
+            chunks.append((self.chunkStart, self.chunkStart + self.frames - 1))
+        index = {"version": VERSION,
+                 "byteorder": sys.byteorder,
+                 "columns": COLUMNS,
+                 "agents": self.names,
+                 "states": self.stateNames,
+                 "frameStart": self.frameStart,
+                 "frameEnd": self.chunkStart + self.frames - 1,
+                 "chunks": [{"file": chunkName(s),
+                             "transitions": transitionsName(s),
+                             "start": s, "end": e}
+                            for s, e in chunks]}
+        self.put(os.path.join(self.directory, "index.json"),
+                 json.dumps(index))
+
+    def flush(self):
+        """Write the frames recorded so far, including the unfinished chunk,
+        and wait for them to be on disk. Recording can carry on afterwards"""
+        if self.frames > 0:
+            self.writeChunk()
+        self.writeIndex()
+        self.wait()
+
+    def truncate(self, frame):
+        """Forget everything recorded after frame so that it can be
+        simulated again"""
+        self.wait()
+        count = len(self.names)
+        if frame < self.chunkStart:
+            self.removeChunk(self.chunkStart)
+            while self.chunks and self.chunks[-1][0] > frame:
+                start, end = self.chunks.pop()
+                self.removeChunk(start)
+            self.values = array('f')
+            self.states = array('i')
+            self.transitions = []
+            if self.chunks:
+                start, end = self.chunks.pop()
+                path = os.path.join(self.directory, chunkName(start))
+                frames = end - start + 1
+                with open(path, "rb") as f:
+                    self.values.fromfile(f, frames * count * len(COLUMNS))
+                    self.states.fromfile(f, frames * count)
+                path = os.path.join(self.directory, transitionsName(start))
+                if os.path.exists(path):
+                    with open(path) as f:
+                        self.transitions = [(t["frame"], t["agent"],
+                                             t["kind"], t["name"])
+                                            for t in json.load(f)]
+                self.removeChunk(start)
+                self.chunkStart = start
+                self.frames = frames
+            else:
+                self.chunkStart = self.frameStart
+                self.frames = 0
+        keep = max(frame - self.chunkStart + 1, 0)
+        del self.values[keep * count * len(COLUMNS):]
+        del self.states[keep * count:]
+        self.frames = min(self.frames, keep)
+        self.transitions = [t for t in self.transitions if t[0] <= frame]
+        # The last frame kept holds every agents state
+        if self.frames > 0:
+            last = self.states[(self.frames - 1) * count:]
+            self.lastStates = [self.stateNames[s] if s >= 0 else None
+                               for s in last]
+        else:
+            self.lastStates = [None] * count
+
+    def removeChunk(self, start):
+        """Delete the files of a chunk if they have been written"""
+        for name in (chunkName(start), transitionsName(start)):
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TrajectoryCache:
+    """Read only access to a cache written by TrajectoryWriter. Chunks are
+    memory mapped when they are first needed so only the frames that are
+    used are read from disk"""
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            self.index = json.load(f)
+        if self.index.get("version") != VERSION:
+            raise ValueError("Trajectory cache written by a different version")
+        if self.index["byteorder"] != sys.byteorder:
+            raise ValueError("Trajectory cache written with a different byte order")
+        self.names = self.index["agents"]
+        self.agentIndex = {n: i for i, n in enumerate(self.names)}
+        self.states = self.index["states"]
+        self.columns = self.index["columns"]
+        self.frameStart = self.index["frameStart"]
+        self.frameEnd = self.index["frameEnd"]
+        self.mapped = {}  # {chunk start: (mmap, float view, int view)}
+
+    def chunkFor(self, frame):
+        for chunk in self.index["chunks"]:
+            if chunk["start"] <= frame <= chunk["end"]:
+                return chunk
+        return None
+
+    def open(self, chunk):
+        if chunk["start"] not in self.mapped:
+            path = os.path.join(self.directory, chunk["file"])
+            with open(path, "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            frames = chunk["end"] - chunk["start"] + 1
+            split = frames * len(self.names) * len(self.columns) * 4
+            view = memoryview(m)
+            self.mapped[chunk["start"]] = (m, view[:split].cast('f'),
+                                           view[split:].cast('i'))
+        return self.mapped[chunk["start"]]
+
+    def frame(self, frame):
+        """The values of every agent on a frame
+
+        :returns: (floats with len(columns) values per agent in the order of
+                  self.names, state id per agent) or None if not cached
+        :rtype: (memoryview, memoryview)"""
+        chunk = self.chunkFor(frame)
+        if chunk is None:
+            return None
+        m, values, states = self.open(chunk)
+        count = len(self.names)
+        width = count * len(self.columns)
+        offset = frame - chunk["start"]
+        return (values[offset * width:(offset + 1) * width],
+                states[offset * count:(offset + 1) * count])
+
+    def transitions(self):
+        """Every state change and action started in frame order
+
+        :rtype: [(frame, agent index, kind, name)]"""
+        result = []
+        for chunk in self.index["chunks"]:
+            path = os.path.join(self.directory, chunk["transitions"])
+            with open(path) as f:
+                result.extend((t["frame"], t["agent"], t["kind"], t["name"])
+                              for t in json.load(f))
+        return result
+
+    def agent(self, name, frame):
+        """The location and rotation of one agent on a frame"""
+        data = self.frame(frame)
+        if data is None:
+            return None
+        values, states = data
+        i = self.agentIndex[name]
+        width = len(self.columns)
+        row = values[i * width:(i + 1) * width]
+        return tuple(row[0:3]), tuple(row[3:6]), states[i]
+
+    def close(self):
+        """Unmap the chunks. A chunk that a view returned by frame is still
+        using stays mapped until the view is freed"""
+        for m, values, states in self.mapped.values():
+            values.release()
+            states.release()
+            try:
+                m.close()
+            except BufferError:
+                pass
+        self.mapped = {}